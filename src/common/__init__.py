@@ -0,0 +1,3 @@
+# Código compartido por los componentes (tracker, seeder y leecher).
+# Los componentes se ejecutan como scripts desde su propia carpeta, así que cada uno añade
+# `src` al `sys.path` antes de importar este paquete.
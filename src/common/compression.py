@@ -0,0 +1,151 @@
+import os
+import threading
+import zlib
+import lzma
+from collections import OrderedDict
+
+# Compresión negociada de chunks, compartida por el seeder y los mini-seeders de los leechers.
+# El cliente puede añadir a su solicitud "ACCEPT=zlib:6,lzma:1" (códecs y niveles en orden de
+# preferencia). En ese caso la respuesta empieza con la cabecera "ENC <códec>\n" seguida del chunk,
+# comprimido con el códec elegido o sin comprimir ("ENC raw") si el chunk apenas se comprime
+# (vídeo, imágenes, archivos ya comprimidos). Sin ACCEPT, el chunk se envía sin cabecera, como antes.
+SUPPORTED_CODECS = ("zlib", "lzma")
+COMPRESSION_SAMPLE_SIZE = 16 * 1024  # Bytes de cada muestra (se toman al inicio, mitad y final del chunk)
+COMPRESSION_MIN_SAVING = 0.1         # Ahorro mínimo (10%) para que merezca la pena enviar comprimido
+COMPRESSED_CACHE_BYTES = 256 * 1024 * 1024  # Memoria máxima para chunks ya comprimidos (por proceso)
+
+# Nivel máximo que el servidor acepta para cada códec. El cliente propone el nivel según su
+# enlace, pero quien paga la compresión es el servidor: lzma con presets altos necesita cientos
+# de MB de memoria y segundos de CPU por chunk, así que se limita a un preset bajo.
+MAX_COMPRESSION_LEVEL = {"zlib": 9, "lzma": 1}
+
+# Tamaño máximo de un chunk descomprimido (el seeder divide el archivo en chunks de 10MB).
+# Un peer que envíe más datos al descomprimir (p. ej. una "bomba" zlib/lzma) hace fallar la
+# descarga antes de llenar el disco.
+MAX_DECOMPRESSED_SIZE = 10 * 1024 * 1024
+
+# Caché LRU de chunks comprimidos: (chunk, códec, nivel) -> bytes. Evita recomprimir los
+# chunks más pedidos para cada cliente. `COMPRESSIBLE_CHUNKS` guarda el resultado del muestreo.
+COMPRESSED_CACHE = OrderedDict()
+COMPRESSION_STATE = {"cache_bytes": 0, "in_progress": {}}
+COMPRESSIBLE_CHUNKS = {}
+COMPRESSION_LOCK = threading.Lock()
+
+# Función para separar una solicitud de chunk en su nombre y sus opciones ("CLAVE=valor").
+def parse_chunk_request(data):
+    tokens = data.split()
+    name = tokens[0] if tokens else ""
+    options = {}
+    for token in tokens[1:]:
+        key, _, value = token.partition("=")
+        options[key.upper()] = value
+    return name, options
+
+# Función para interpretar la opción ACCEPT: "zlib:6,lzma:1" -> [("zlib", 6), ("lzma", 1)].
+# Se descartan los códecs desconocidos y los niveles se limitan a 0-MAX_COMPRESSION_LEVEL.
+def parse_accept(value):
+    codecs = []
+    for item in value.split(","):
+        codec, _, level = item.partition(":")
+        if codec not in SUPPORTED_CODECS:
+            continue
+        try:
+            level = int(level) if level else 6
+        except ValueError:
+            continue
+        codecs.append((codec, max(0, min(level, MAX_COMPRESSION_LEVEL[codec]))))
+    return codecs
+
+# Función para comprimir un bloque de datos con el códec y nivel indicados.
+def compress_data(data, codec, level):
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    return lzma.compress(data, preset=level)
+
+# Función para estimar si un chunk merece comprimirse, comprimiendo (rápido) tres muestras.
+# El resultado se recuerda por chunk para no repetir el muestreo.
+def is_compressible(chunk_name, path):
+    with COMPRESSION_LOCK:
+        if chunk_name in COMPRESSIBLE_CHUNKS:
+            return COMPRESSIBLE_CHUNKS[chunk_name]
+    size = os.path.getsize(path)
+    sample = b""
+    with open(path, 'rb') as f:
+        for offset in (0, max(size // 2 - COMPRESSION_SAMPLE_SIZE // 2, 0), max(size - COMPRESSION_SAMPLE_SIZE, 0)):
+            f.seek(offset)
+            sample += f.read(COMPRESSION_SAMPLE_SIZE)
+    compressible = bool(sample) and \
+        len(zlib.compress(sample, 1)) <= len(sample) * (1 - COMPRESSION_MIN_SAVING)
+    with COMPRESSION_LOCK:
+        COMPRESSIBLE_CHUNKS[chunk_name] = compressible
+    return compressible
+
+# Función para obtener la forma codificada de un chunk según los códecs que acepta el cliente.
+# Retorna (códec, datos comprimidos) o ("raw", None) si el chunk debe enviarse sin comprimir.
+# Si varios clientes piden a la vez el mismo chunk, solo uno lo comprime y el resto espera.
+def get_encoded_chunk(chunk_name, path, codecs):
+    if not codecs or not is_compressible(chunk_name, path):
+        return "raw", None
+    codec, level = codecs[0]
+    key = (chunk_name, codec, level)
+    while True:
+        with COMPRESSION_LOCK:
+            if key in COMPRESSED_CACHE:
+                COMPRESSED_CACHE.move_to_end(key)
+                return codec, COMPRESSED_CACHE[key]
+            if not COMPRESSIBLE_CHUNKS.get(chunk_name, True):
+                return "raw", None
+            pending = COMPRESSION_STATE["in_progress"].get(key)
+            if pending is None:
+                pending = COMPRESSION_STATE["in_progress"][key] = threading.Event()
+                break
+        pending.wait()
+
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        payload = compress_data(data, codec, level)
+        with COMPRESSION_LOCK:
+            if len(payload) > len(data) * (1 - COMPRESSION_MIN_SAVING):
+                # El muestreo fue optimista: el chunk completo no se comprime lo suficiente.
+                COMPRESSIBLE_CHUNKS[chunk_name] = False
+                return "raw", None
+            if len(payload) <= COMPRESSED_CACHE_BYTES:
+                COMPRESSED_CACHE[key] = payload
+                COMPRESSION_STATE["cache_bytes"] += len(payload)
+                while COMPRESSION_STATE["cache_bytes"] > COMPRESSED_CACHE_BYTES:
+                    _, evicted = COMPRESSED_CACHE.popitem(last=False)
+                    COMPRESSION_STATE["cache_bytes"] -= len(evicted)
+        return codec, payload
+    finally:
+        with COMPRESSION_LOCK:
+            COMPRESSION_STATE["in_progress"].pop(key).set()
+
+# Descompresor con límite de salida: nunca produce más de `limit` bytes en total y lanza
+# ValueError en cuanto los datos recibidos descomprimirían a más.
+class BoundedDecompressor:
+    def __init__(self, codec, limit=MAX_DECOMPRESSED_SIZE):
+        self.inner = zlib.decompressobj() if codec == "zlib" else lzma.LZMADecompressor()
+        self.limit = limit
+        self.total = 0
+
+    def decompress(self, data):
+        # Se pide como mucho un byte más de lo permitido para detectar el exceso sin producirlo entero.
+        return self.count(self.inner.decompress(data, self.limit - self.total + 1))
+
+    def flush(self):
+        return self.count(self.inner.flush()) if hasattr(self.inner, "flush") else b""
+
+    def count(self, data):
+        self.total += len(data)
+        if self.total > self.limit:
+            raise ValueError(f"el chunk descomprimido supera {self.limit} bytes")
+        return data
+
+# Función para crear el descompresor de la cabecera "ENC <códec>". Retorna None para "raw".
+def make_decompressor(codec):
+    if codec == "raw":
+        return None
+    if codec in SUPPORTED_CODECS:
+        return BoundedDecompressor(codec)
+    raise ValueError(f"códec desconocido: {codec}")
@@ -0,0 +1,14 @@
+import os
+
+# Canal de aviso al lanzador (main.py). Si existe la variable de entorno P2P_READY_FD,
+# el componente escribe ahí "READY" cuando ya puede atender peticiones, o "STATUS ..."
+# para informar de su progreso durante el arranque.
+READY_FD = os.environ.get("P2P_READY_FD")
+
+def notify_launcher(message):
+    if READY_FD is None:
+        return
+    try:
+        os.write(int(READY_FD), f"{message}\n".encode())
+    except OSError:
+        pass # El lanzador ya no escucha (o no hay lanzador); no es un error del componente.
@@ -0,0 +1,39 @@
+import hashlib
+
+# Árbol de Merkle de cada chunk, compartido por el seeder (que genera `merkle.txt`) y los
+# leechers (que verifican y reparan bloque a bloque).
+# Tamaño de bloque del árbol (256KB). Los leechers verifican y, si hace falta, vuelven a pedir
+# los chunks por bloques de este tamaño ("BLOCKS=primero-último").
+MERKLE_BLOCK_SIZE = 256 * 1024
+
+# Función para calcular la raíz del árbol de Merkle a partir de los hashes de sus hojas (hex).
+# Los nodos internos son SHA-256(0x01 + izquierdo + derecho); si un nivel tiene un número
+# impar de nodos, el último se empareja consigo mismo.
+def merkle_root(leaves):
+    level = [bytes.fromhex(leaf) for leaf in leaves]
+    if not level:
+        return hashlib.sha256(b"").hexdigest()
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+# Función para calcular los hashes de las hojas de un chunk: SHA-256(0x00 + bloque) por cada
+# bloque de MERKLE_BLOCK_SIZE bytes (el último bloque puede ser más corto).
+def merkle_leaves(data):
+    return [hashlib.sha256(b"\x00" + data[i:i + MERKLE_BLOCK_SIZE]).hexdigest()
+            for i in range(0, len(data), MERKLE_BLOCK_SIZE)]
+
+# Función para interpretar la opción BLOCKS ("3-5", ambos incluidos) como un rango de bytes
+# (inicio, longitud) dentro del chunk. Retorna None si la opción no es válida.
+def parse_block_range(value):
+    first, _, last = value.partition("-")
+    try:
+        first = int(first)
+        last = int(last) if last else first
+    except ValueError:
+        return None
+    if first < 0 or last < first:
+        return None
+    return first * MERKLE_BLOCK_SIZE, (last - first + 1) * MERKLE_BLOCK_SIZE
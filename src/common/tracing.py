@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import struct
+import atexit
+import signal
+import threading
+
+# Registro de eventos (flight recorder) para analizar transferencias con `src/trace_timeline.py`.
+# Se activa con la variable de entorno P2P_TRACE_DIR: cada componente de cada proceso escribe un
+# archivo binario "<componente>-<pid>.trace" con una cabecera (nodo y reloj de referencia) y
+# registros de 25 bytes (instante monotónico en ns, evento, ids de chunk y peer, valor). Los textos
+# (nombres de chunks y peers) se escriben una sola vez y después se referencian por id. Los registros
+# se acumulan en memoria y se vuelcan a disco cada 64KB, cada segundo (hilo de volcado), al salir
+# y al recibir SIGTERM (que termina el proceso sin pasar por `atexit`).
+TRACE_DIR = os.environ.get("P2P_TRACE_DIR")
+TRACE_EVENTS = {"queue": 1, "connect": 2, "request": 3, "first_byte": 4, "last_byte": 5,
+                "hash_start": 6, "hash_end": 7, "disk_write": 8, "announce": 9, "done": 10}
+TRACE_RECORD = struct.Struct("<QBIIQ")
+TRACE_BUFFER_SIZE = 64 * 1024  # Bytes acumulados que fuerzan un volcado inmediato
+TRACE_FLUSH_INTERVAL = 1       # Segundos entre volcados del hilo de volcado
+
+# Registros creados en este proceso, para volcarlos todos al recibir SIGTERM.
+RECORDERS = []
+
+# Registro de eventos de un componente. `node` identifica al nodo en el timeline
+# (p. ej. "seeder@10.0.0.1:6000") y puede cambiarse antes del primer evento.
+class Recorder:
+    def __init__(self, component, node):
+        self.component = component
+        self.node = node
+        self.file = None
+        self.pid = None
+        self.strings = {}
+        self.buffer = bytearray()
+        # Reentrante: el manejador de SIGTERM vuelca desde el hilo principal, que puede
+        # haber sido interrumpido mientras tenía el lock.
+        self.lock = threading.RLock()
+        RECORDERS.append(self)
+
+    def string(self, text):
+        if text not in self.strings:
+            self.strings[text] = len(self.strings)
+            data = text.encode()
+            self.buffer += TRACE_RECORD.pack(0, 0, self.strings[text], len(data), 0) + data
+        return self.strings[text]
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None and self.pid == os.getpid() and self.buffer:
+                self.file.write(self.buffer)
+                self.buffer.clear()
+
+    # Vuelca el buffer cada TRACE_FLUSH_INTERVAL segundos mientras el proceso que abrió el archivo
+    # siga siendo este (un hijo creado con fork abre su propio archivo y su propio hilo).
+    def flusher(self, pid):
+        while self.pid == pid:
+            time.sleep(TRACE_FLUSH_INTERVAL)
+            self.flush()
+
+    # Registra un evento. `value` depende del evento: bytes en "last_byte", nanosegundos en "connect"
+    # (duración de la conexión) y "disk_write", y 1/0 (éxito/fallo) en "done".
+    def event(self, event, chunk="", peer="", value=0):
+        if TRACE_DIR is None:
+            return
+        now = time.monotonic_ns()
+        with self.lock:
+            if self.pid != os.getpid():
+                # Primer evento del proceso (o de un worker recién creado con fork): abre su propio archivo.
+                os.makedirs(TRACE_DIR, exist_ok=True)
+                path = os.path.join(TRACE_DIR, f"{self.component}-{os.getpid()}.trace")
+                # Sin buffer de Python: los registros ya se acumulan en `self.buffer`, y así un hijo creado
+                # con fork no hereda bytes pendientes que escribiría después en el archivo del padre.
+                self.file, self.pid, self.strings, self.buffer = open(path, 'wb', buffering=0), os.getpid(), {}, bytearray()
+                node = self.node.encode()
+                self.file.write(b"P2PTRACE" + struct.pack("<BQQH", 1, time.time_ns(), now, len(node)) + node)
+                atexit.register(self.flush)
+                threading.Thread(target=self.flusher, args=(self.pid,), daemon=True).start()
+            self.buffer += TRACE_RECORD.pack(now, TRACE_EVENTS[event], self.string(chunk), self.string(peer), value)
+            flush = len(self.buffer) >= TRACE_BUFFER_SIZE
+        if flush:
+            self.flush()
+
+# Un hijo creado con fork puede heredar el lock tomado por otro hilo del padre (que no existe
+# en el hijo): cada registro empieza con un lock nuevo.
+def reset_locks():
+    for recorder in RECORDERS:
+        recorder.lock = threading.RLock()
+
+os.register_at_fork(after_in_child=reset_locks)
+
+# Manejador de SIGTERM: vuelca todos los registros y después sigue con el manejador que hubiera
+# antes o, si no había ninguno, termina el proceso con sys.exit (que además ejecuta `atexit`).
+def flush_on_sigterm(previous):
+    def handler(signum, frame):
+        for recorder in RECORDERS:
+            recorder.flush()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            sys.exit(128 + signum)
+    return handler
+
+# Función para crear el registro de un componente. Con el registro activado instala también el
+# manejador de SIGTERM (solo es posible desde el hilo principal, donde se importan los componentes).
+# Un componente que instale después su propio manejador debe terminar con sys.exit para que
+# `atexit` vuelque los registros.
+def create_recorder(component, node):
+    recorder = Recorder(component, node)
+    if TRACE_DIR is not None and threading.current_thread() is threading.main_thread():
+        previous = signal.getsignal(signal.SIGTERM)
+        if getattr(previous, "flushes_traces", False):
+            return recorder # Ya instalado por otro componente del mismo proceso.
+        handler = flush_on_sigterm(previous)
+        handler.flushes_traces = True
+        signal.signal(signal.SIGTERM, handler)
+    return recorder
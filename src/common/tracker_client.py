@@ -0,0 +1,18 @@
+import socket
+
+# Función para enviar un comando al tracker y devolver su respuesta completa como texto.
+# Tras enviar el comando se cierra el sentido de escritura para que el tracker sepa que la
+# solicitud está completa; la respuesta se lee hasta que el tracker cierra la conexión.
+# `connect_timeout` limita el establecimiento de la conexión y `timeout` cada lectura.
+def query_tracker(tracker_ip, tracker_port, message, connect_timeout=5, timeout=5):
+    s = socket.create_connection((tracker_ip, tracker_port), timeout=connect_timeout)
+    try:
+        s.settimeout(timeout)
+        s.sendall(message.encode())
+        s.shutdown(socket.SHUT_WR)
+        response = b""
+        while data := s.recv(65536):
+            response += data
+        return response.decode()
+    finally:
+        s.close()
@@ -4,6 +4,15 @@ import hashlib
 import ast
 import threading
 import time
+import sys
+
+# Los módulos compartidos entre componentes están en `src/common`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.compression import parse_chunk_request, parse_accept, get_encoded_chunk, make_decompressor
+from common.launcher import notify_launcher
+from common.merkle import MERKLE_BLOCK_SIZE, merkle_root, parse_block_range
+from common.tracing import create_recorder
+from common.tracker_client import query_tracker
 
 # Parámetros de configuración del Leecher
 TRACKER_PORT = 8000         # Puerto del tracker al que el leecher se conecta
@@ -24,6 +33,71 @@ os.makedirs(CHUNK_DIR, exist_ok=True) # Asegura que el directorio exista
 # Esto es esencial para la verificación de integridad.
 DOWNLOADED_CHECKSUMS = {}
 
+# Manifiesto Merkle descargado del seeder: nombre_chunk -> {"root": raíz, "leaves": [hash por bloque]}.
+# Permite verificar cada bloque de MERKLE_BLOCK_SIZE bytes según llega y volver a pedir solo
+# los bloques corruptos. Si el seeder no ofrece `merkle.txt`, solo se verifica el chunk completo.
+DOWNLOADED_MERKLE = {}
+
+# Bloques corruptos atribuidos a cada peer "IP:PUERTO". A partir de MAX_CORRUPT_BLOCKS
+# el peer deja de usarse como fuente de chunks.
+PEER_CORRUPT_BLOCKS = {}
+MAX_CORRUPT_BLOCKS = 3
+PEER_CORRUPTION_LOCK = threading.Lock()
+
+# Tiempos de espera (en segundos) para todas las conexiones del leecher.
+# CONNECT_TIMEOUT limita el establecimiento de la conexión TCP y IDLE_TIMEOUT el tiempo
+# máximo sin recibir ni un solo byte antes de dar la transferencia por perdida.
+CONNECT_TIMEOUT = 5
+IDLE_TIMEOUT = 15
+# Intervalo con el que se revisa el estado de una transferencia en curso (cancelación,
+# inactividad y velocidad). También es el timeout de cada `recv` individual.
+POLL_INTERVAL = 0.5
+
+# Detección de transferencias estancadas: tras STALL_GRACE_PERIOD segundos, si la velocidad
+# de una descarga cae por debajo de STALL_FACTOR veces la velocidad habitual del peer,
+# se considera estancada y se lanza una solicitud duplicada (hedged) a otro peer.
+STALL_GRACE_PERIOD = 3
+STALL_FACTOR = 0.25
+# Máximo de solicitudes duplicadas que se lanzan para un mismo chunk.
+MAX_HEDGES = 2
+
+# Rondas de descarga: si en MAX_IDLE_ROUNDS rondas seguidas no se consigue ningún chunk nuevo,
+# el leecher deja de intentarlo. Entre rondas espera ROUND_RETRY_DELAY segundos.
+MAX_IDLE_ROUNDS = 5
+ROUND_RETRY_DELAY = 5
+
+# Velocidad habitual (bytes/s) observada por cada peer "IP:PUERTO".
+# Se actualiza con una media móvil exponencial tras cada descarga correcta.
+PEER_RATES = {}
+PEER_RATE_ALPHA = 0.3
+PEER_RATES_LOCK = threading.Lock()
+
+# Tiempo habitual (s) desde la solicitud hasta el primer byte de cada peer (incluye el tiempo que
+# el peer tarda en comprimir el chunk), con la misma media móvil. Si el primer byte tarda más de
+# FIRST_BYTE_FACTOR veces lo habitual (y al menos STALL_GRACE_PERIOD), la descarga se considera
+# estancada: un peer que acepta la conexión y nunca envía nada no retiene el chunk hasta IDLE_TIMEOUT.
+PEER_FIRST_BYTE = {}
+FIRST_BYTE_FACTOR = 4
+
+# Al descargar, el leecher pide compresión con un nivel acorde a la velocidad del enlace:
+# en enlaces rápidos la CPU sería el cuello de botella (zlib nivel 1); en enlaces lentos
+# compensa comprimir más (lzma). COMPRESSION_ENABLED = False pide siempre los chunks sin comprimir.
+COMPRESSION_ENABLED = True
+FAST_LINK_RATE = 50 * 1024 * 1024  # bytes/s
+SLOW_LINK_RATE = 5 * 1024 * 1024   # bytes/s
+
+# Registro de eventos para `src/trace_timeline.py` (ver `common/tracing.py`);
+# se activa con la variable de entorno P2P_TRACE_DIR.
+TRACER = create_recorder("leecher", f"leecher@{TARGET_IP}:{LEECHER_SERVER_PORT}")
+trace_event = TRACER.event
+
+# Función para abrir una conexión TCP con los tiempos de espera configurados.
+# Tras conectar, el socket queda con IDLE_TIMEOUT para las operaciones de lectura/escritura.
+def open_connection(ip, port, timeout=IDLE_TIMEOUT):
+    s = socket.create_connection((ip, port), timeout=CONNECT_TIMEOUT)
+    s.settimeout(timeout)
+    return s
+
 # Función para calcular el hash SHA-256 de un archivo dado.
 # Utilizado para verificar la integridad de los chunks descargados.
 def calculate_sha256(file_path):
@@ -40,9 +114,9 @@ def calculate_sha256(file_path):
 # Ahora toma el puerto del seeder como argumento.
 def download_checksums_from_seeder(seeder_ip, seeder_port):
     print(f"Intentando descargar checksums.txt desde {seeder_ip}:{seeder_port}")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s = None
     try:
-        s.connect((seeder_ip, seeder_port)) # Conecta al seeder usando su puerto CORRECTO
+        s = open_connection(seeder_ip, seeder_port) # Conecta al seeder usando su puerto CORRECTO
         s.sendall(b"checksums.txt")     # Solicita el archivo de checksums.
         
         path = os.path.join(CHUNK_DIR, "checksums.txt")
@@ -71,7 +145,187 @@ def download_checksums_from_seeder(seeder_ip, seeder_port):
         print(f"Error al descargar o procesar checksums.txt desde {seeder_ip}:{seeder_port}: {e}")
         return {} # Retorna un diccionario vacío en caso de error
     finally:
-        s.close() # Asegura que el socket se cierre.
+        if s:
+            s.close() # Asegura que el socket se cierre.
+
+# Función para descargar el manifiesto Merkle (`merkle.txt`) desde el seeder principal.
+# Cada línea es "nombre_chunk raíz hoja_0,hoja_1,...". Solo se aceptan las entradas cuyas
+# hojas reproducen la raíz anunciada.
+def download_merkle_from_seeder(seeder_ip, seeder_port):
+    global DOWNLOADED_MERKLE
+    s = None
+    try:
+        s = open_connection(seeder_ip, seeder_port)
+        s.sendall(b"merkle.txt")
+        data = b""
+        while chunk := s.recv(65536):
+            data += chunk
+        if data.startswith(b"ERROR"):
+            print("El seeder no ofrece manifiesto Merkle; se verificarán solo chunks completos.")
+            return {}
+
+        merkle = {}
+        for line in data.decode().splitlines():
+            name, root, leaves = line.split()
+            leaves = leaves.split(",")
+            if merkle_root(leaves) == root:
+                merkle[name] = {"root": root, "leaves": leaves}
+            else:
+                print(f"Entrada Merkle de {name} inconsistente; se ignora.")
+        DOWNLOADED_MERKLE = merkle
+        print(f"Manifiesto Merkle descargado: {len(merkle)} chunks.")
+        return merkle
+    except Exception as e:
+        print(f"Error al descargar o procesar merkle.txt desde {seeder_ip}:{seeder_port}: {e}")
+        return {}
+    finally:
+        if s:
+            s.close()
+
+# Funciones para verificar un chunk bloque a bloque mientras se recibe.
+# El estado es un diccionario con las hojas esperadas, el bloque actual, los bytes que lleva
+# y los índices de los bloques que no coinciden. Retorna None si no hay manifiesto del chunk.
+def new_block_state(chunk_name):
+    tree = DOWNLOADED_MERKLE.get(chunk_name)
+    if tree is None:
+        return None
+    return {"leaves": tree["leaves"], "index": 0, "filled": 0,
+            "hasher": hashlib.sha256(b"\x00"), "bad": []}
+
+def close_block(state):
+    index = state["index"]
+    if index >= len(state["leaves"]) or state["hasher"].hexdigest() != state["leaves"][index]:
+        state["bad"].append(index)
+    state["index"] += 1
+    state["filled"] = 0
+    state["hasher"] = hashlib.sha256(b"\x00")
+
+def feed_blocks(state, data):
+    if state is None:
+        return
+    view = memoryview(data)
+    while view:
+        take = min(len(view), MERKLE_BLOCK_SIZE - state["filled"])
+        state["hasher"].update(view[:take])
+        state["filled"] += take
+        view = view[take:]
+        if state["filled"] == MERKLE_BLOCK_SIZE:
+            close_block(state)
+
+# Cierra el último bloque (que puede ser más corto). Retorna dos listas de índices:
+# los bloques recibidos que no coinciden y los que no llegaron (transferencia truncada).
+# Un bloque incompleto al final de la transferencia cuenta como no recibido, no como corrupto:
+# solo la última hoja del chunk puede ser más corta que MERKLE_BLOCK_SIZE, y si tampoco coincide
+# con su hash no se puede distinguir de un corte, así que no se atribuye al peer.
+def finish_blocks(state):
+    if state is None:
+        return [], []
+    index = state["index"]
+    if state["filled"] and index == len(state["leaves"]) - 1 and \
+       state["hasher"].hexdigest() == state["leaves"][index]:
+        close_block(state)
+    return state["bad"], list(range(state["index"], len(state["leaves"])))
+
+# Registra los bloques corruptos enviados por un peer.
+def record_corruption(peer_info, chunk_name, blocks):
+    with PEER_CORRUPTION_LOCK:
+        PEER_CORRUPT_BLOCKS[peer_info] = PEER_CORRUPT_BLOCKS.get(peer_info, 0) + len(blocks)
+        total = PEER_CORRUPT_BLOCKS[peer_info]
+    print(f"{peer_info} envió {len(blocks)} bloques corruptos de {chunk_name}: {blocks} "
+          f"({total} en total).")
+    if total >= MAX_CORRUPT_BLOCKS:
+        print(f"{peer_info} supera {MAX_CORRUPT_BLOCKS} bloques corruptos; no se usará más como fuente.")
+
+# Indica si un peer ha enviado demasiados bloques corruptos para seguir usándolo.
+def is_banned(peer_info):
+    with PEER_CORRUPTION_LOCK:
+        return PEER_CORRUPT_BLOCKS.get(peer_info, 0) >= MAX_CORRUPT_BLOCKS
+
+# Función para pedir a un peer solo los bloques `first`..`last` (incluidos) de un chunk.
+# Retorna los bytes recibidos o None si el peer rechaza la solicitud o falla la conexión.
+# Se leen como mucho los bytes de esos bloques; lo que el peer envíe de más se ignora.
+def fetch_blocks(peer_info, chunk_name, first, last):
+    s = None
+    try:
+        peer_ip, peer_port = peer_info.rsplit(':', 1)
+        s = open_connection(peer_ip.strip("[]"), int(peer_port))
+        s.sendall(f"{chunk_name} BLOCKS={first}-{last} PEER={own_peer_info()}".encode())
+        expected = (last - first + 1) * MERKLE_BLOCK_SIZE
+        data = b""
+        while len(data) < expected and (chunk := s.recv(65536)):
+            data += chunk
+        if data.startswith(b"ERROR") and len(data) < 256:
+            print(f"{peer_info} no entregó los bloques {first}-{last} de {chunk_name}: {data.decode(errors='replace')}")
+            return None
+        return data
+    except Exception as e:
+        print(f"Error al pedir los bloques {first}-{last} de {chunk_name} a {peer_info}: {e}")
+        return None
+    finally:
+        if s:
+            s.close()
+
+# Agrupa índices de bloque ordenados en rangos consecutivos [primero, último], para pedir
+# cada rango en una sola conexión.
+def block_ranges(indices):
+    ranges = []
+    for index in indices:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+# Verifica los bloques `first`..`last` recibidos en `data` contra sus hojas y escribe los correctos
+# en su posición del archivo. Retorna los índices de los bloques que no coinciden o no llegaron.
+def write_repaired_blocks(chunk_path, chunk_name, first, last, data):
+    leaves = DOWNLOADED_MERKLE[chunk_name]["leaves"]
+    corrupt = []
+    with open(chunk_path, 'r+b') as f:
+        for index in range(first, last + 1):
+            offset = (index - first) * MERKLE_BLOCK_SIZE
+            block = data[offset:offset + MERKLE_BLOCK_SIZE]
+            if block and hashlib.sha256(b"\x00" + block).hexdigest() == leaves[index]:
+                f.seek(index * MERKLE_BLOCK_SIZE)
+                f.write(block)
+            else:
+                corrupt.append(index)
+    return corrupt
+
+# Cierra una ronda de reparación con un peer: le atribuye los bloques corruptos y retorna
+# los bloques que siguen pendientes para el siguiente peer.
+def finish_repair_round(peer_info, chunk_name, remaining, still_bad, corrupt):
+    if corrupt:
+        record_corruption(peer_info, chunk_name, corrupt)
+    repaired = len(remaining) - len(still_bad)
+    if repaired:
+        print(f"Reparados {repaired} bloques de {chunk_name} desde {peer_info}.")
+    return still_bad
+
+# Función para reparar un chunk pidiendo solo sus bloques corruptos a los peers indicados (en orden).
+# Cada bloque recibido se verifica contra su hoja antes de escribirlo en su posición del archivo.
+# Retorna True si todos los bloques quedaron reparados.
+def repair_blocks(chunk_path, chunk_name, bad_blocks, peers):
+    leaves = DOWNLOADED_MERKLE[chunk_name]["leaves"]
+    if any(index >= len(leaves) for index in bad_blocks):
+        return False # El peer envió más datos de los esperados: no se puede reparar por bloques.
+    remaining = sorted(set(bad_blocks))
+    for peer_info in peers:
+        if not remaining:
+            break
+        if is_banned(peer_info):
+            continue
+        still_bad, corrupt = [], []
+        for first, last in block_ranges(remaining):
+            data = fetch_blocks(peer_info, chunk_name, first, last)
+            if data is None:
+                still_bad.extend(range(first, last + 1))
+                continue
+            bad = write_repaired_blocks(chunk_path, chunk_name, first, last, data)
+            still_bad.extend(bad)
+            corrupt.extend(bad)
+        remaining = finish_repair_round(peer_info, chunk_name, remaining, still_bad, corrupt)
+    return not remaining
 
 # Función para verificar un chunk descargado comparando su checksum calculado
 # con el checksum esperado (obtenido del archivo checksums.txt).
@@ -85,51 +339,333 @@ def verify_chunk(path, expected_checksum):
 # Función para descubrir peers contactando al tracker.
 def discover_peers():
     print(f"Conectando al tracker en {TARGET_IP}:{TRACKER_PORT} para descubrir peers...")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     peers_list = []
     try:
-        s.connect((TARGET_IP, TRACKER_PORT)) # Conecta al tracker.
-        s.sendall(b"DISCOVER")             # Solicita la lista de peers disponibles.
-        data = s.recv(1024).decode()       # Recibe la lista de peers como string.
+        data = query_tracker(TARGET_IP, TRACKER_PORT, "DISCOVER", CONNECT_TIMEOUT, IDLE_TIMEOUT)    # Solicita la lista de peers disponibles.
         peers_list = ast.literal_eval(data) # Convierte el string a una lista de Python.
         print(f"Peers encontrados: {peers_list}")
     except Exception as e:
         print(f"Error al descubrir peers desde el tracker: {e}")
-    finally:
-        s.close() # Asegura que el socket se cierre.
     return peers_list
 
+# Función para consultar al tracker qué chunks anuncia un peer concreto ("IP:PUERTO").
+# Usa el comando GET_CHUNKS del tracker, que responde con los nombres separados por comas.
+def get_peer_chunks(peer_info):
+    try:
+        data = query_tracker(TARGET_IP, TRACKER_PORT, f"GET_CHUNKS {peer_info}", CONNECT_TIMEOUT, IDLE_TIMEOUT)
+        if not data or data == "Peer no encontrado.":
+            return []
+        return data.split(",")
+    except Exception as e:
+        print(f"Error al consultar los chunks de {peer_info} en el tracker: {e}")
+        return []
+
+# Función para construir la lista de peers candidatos ("IP:PUERTO") para cada chunk.
+# Primero van los peers que anuncian el chunk y el seeder principal siempre al final, como
+# alternativa para reintentos y solicitudes duplicadas (hedged): así la subida del seeder se
+# reserva para los chunks que todavía no circulan (o cuyos peers fallan).
+def build_chunk_candidates(peers, chunk_names):
+    seeder_info = f"{TARGET_IP}:{SEEDER_PORT}"
+    own_info = own_peer_info()
+    candidates = {name: [] for name in chunk_names}
+    for peer_info in peers:
+        if peer_info in (seeder_info, own_info) or is_banned(peer_info):
+            continue
+        for name in get_peer_chunks(peer_info):
+            if name in candidates:
+                candidates[name].append(peer_info)
+    for name in candidates:
+        candidates[name].append(seeder_info)
+    return candidates
+
+# Función para obtener la velocidad de referencia de un peer.
+# Si todavía no hay mediciones de ese peer, se usa la mediana del resto de peers.
+def expected_peer_rate(peer_info):
+    with PEER_RATES_LOCK:
+        if peer_info in PEER_RATES:
+            return PEER_RATES[peer_info]
+        rates = sorted(PEER_RATES.values())
+    if not rates:
+        return None
+    return rates[len(rates) // 2]
+
+# Función para actualizar la velocidad habitual de un peer tras una descarga correcta.
+def update_peer_rate(peer_info, rate):
+    with PEER_RATES_LOCK:
+        previous = PEER_RATES.get(peer_info)
+        if previous is None:
+            PEER_RATES[peer_info] = rate
+        else:
+            PEER_RATES[peer_info] = PEER_RATE_ALPHA * rate + (1 - PEER_RATE_ALPHA) * previous
+
+# Función para actualizar el tiempo habitual hasta el primer byte de un peer.
+def update_peer_first_byte(peer_info, seconds):
+    with PEER_RATES_LOCK:
+        previous = PEER_FIRST_BYTE.get(peer_info)
+        if previous is None:
+            PEER_FIRST_BYTE[peer_info] = seconds
+        else:
+            PEER_FIRST_BYTE[peer_info] = PEER_RATE_ALPHA * seconds + (1 - PEER_RATE_ALPHA) * previous
+
+# Función para obtener los segundos que se esperan el primer byte de un peer antes de considerar
+# la descarga estancada.
+def first_byte_deadline(peer_info):
+    with PEER_RATES_LOCK:
+        usual = PEER_FIRST_BYTE.get(peer_info, 0)
+    return max(STALL_GRACE_PERIOD, usual * FIRST_BYTE_FACTOR)
+
+# Función para construir la opción ACCEPT que se envía a un peer según la velocidad de su enlace.
+def accept_option(peer_info):
+    rate = expected_peer_rate(peer_info)
+    if rate is None:
+        return "zlib:6"
+    if rate >= FAST_LINK_RATE:
+        return "zlib:1"
+    if rate >= SLOW_LINK_RATE:
+        return "zlib:6"
+    return "lzma:1,zlib:9"
+
+# Función para obtener el "IP:PUERTO" con el que este leecher se anuncia en el tracker.
+def own_peer_info():
+    return f"{TARGET_IP}:{LEECHER_SERVER_PORT}"
+
+# Función para construir la solicitud de un chunk: el nombre, el "IP:PUERTO" anunciado (opción
+# PEER, con la que el seeder en super-seeding distingue a leechers que comparten IP) y, si se
+# usa compresión, los códecs aceptados según el enlace con el peer (opción ACCEPT).
+def chunk_request(chunk_name, peer_info):
+    request = f"{chunk_name} PEER={own_peer_info()}"
+    if COMPRESSION_ENABLED:
+        request += f" ACCEPT={accept_option(peer_info)}"
+    return request
+
 # Función para descargar un chunk específico de otro peer (seeder o mini-seeder).
-def download_chunk(peer_ip, peer_port, chunk_name, expected_checksum):
+# - `dest_path` permite descargar a un archivo temporal (usado por las solicitudes duplicadas).
+# - `cancel_event` aborta la transferencia cuando otra copia del mismo chunk ya ha terminado.
+# - `on_stall` se invoca una sola vez si la velocidad cae muy por debajo de la habitual del peer.
+# - `repair_peers` son los peers a los que pedir los bloques que lleguen corruptos (según el
+#   manifiesto Merkle), en lugar de descartar el chunk entero. Por defecto, el mismo peer.
+# Retorna True si el chunk se descargó y verificó correctamente.
+def download_chunk(peer_ip, peer_port, chunk_name, expected_checksum, dest_path=None, cancel_event=None, on_stall=None,
+                   repair_peers=None):
     print(f"Descargando {chunk_name} desde {peer_ip}:{peer_port}...")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    chunk_path = os.path.join(CHUNK_DIR, chunk_name)
+    peer_info = f"{peer_ip}:{peer_port}"
+    chunk_path = dest_path or os.path.join(CHUNK_DIR, chunk_name)
+    s = None
     try:
-        s.connect((peer_ip, peer_port)) # Conecta al peer que tiene el chunk.
-        s.sendall(chunk_name.encode())  # Solicita el chunk por su nombre.
-        
+        connect_started = time.monotonic_ns()
+        s = open_connection(peer_ip, peer_port, timeout=POLL_INTERVAL) # Conecta al peer que tiene el chunk.
+        trace_event("connect", chunk_name, peer_info, time.monotonic_ns() - connect_started)
+        # Solicita el chunk por su nombre, indicando los códecs de compresión aceptados.
+        s.sendall(chunk_request(chunk_name, peer_info).encode())
+        trace_event("request", chunk_name, peer_info)
+        requested = time.monotonic()
+        first_byte_limit = first_byte_deadline(peer_info)
+
+        norm = expected_peer_rate(peer_info)
+        stalled = False
+        received = 0  # Bytes recibidos por la red (comprimidos), usados para medir la velocidad.
+        head = b""    # Primeros bytes de la respuesta, para detectar cabecera o rechazo ("ERROR: ...").
+        header_done = not COMPRESSION_ENABLED
+        header_buf = b""
+        blocks = new_block_state(chunk_name) # Verificación bloque a bloque (si hay manifiesto Merkle).
+        decompressor = None
+        # La velocidad se mide desde el primer byte: el tiempo que el peer tarda en comprimir
+        # el chunk antes de enviarlo no es lentitud del enlace. La espera hasta el primer byte se
+        # vigila aparte, respecto a la habitual del peer (`first_byte_deadline`).
+        started = None
+        last_data = time.monotonic()
+        disk_ns = 0  # Tiempo total escribiendo en disco, para el registro de eventos.
         with open(chunk_path, 'wb') as f:
             while True:
-                data = s.recv(4096) # Recibe datos en bloques de 4KB.
-                if not data:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise InterruptedError("descarga cancelada, otra copia terminó antes")
+                try:
+                    data = s.recv(4096) # Recibe datos en bloques de 4KB.
+                except socket.timeout:
+                    data = None
+                now = time.monotonic()
+                if data is None:
+                    if now - last_data > IDLE_TIMEOUT:
+                        raise TimeoutError(f"sin datos durante {IDLE_TIMEOUT} s")
+                elif not data:
                     break # Fin de la descarga.
-                f.write(data) # Escribe los datos en el archivo.
-        
+                else:
+                    received += len(data)
+                    last_data = now
+                    if started is None:
+                        started = now
+                        update_peer_first_byte(peer_info, started - requested)
+                        trace_event("first_byte", chunk_name, peer_info)
+                    if len(head) < 256:
+                        head += data[:256]
+                    if not header_done:
+                        # Espera a tener la línea "ENC <códec>" completa antes de escribir datos.
+                        # Un rechazo ("ERROR: ...") no lleva salto de línea y llega hasta el cierre.
+                        header_buf += data
+                        if b"\n" not in header_buf or header_buf.startswith(b"ERROR"):
+                            if len(header_buf) >= 256:
+                                raise ValueError("respuesta sin cabecera de codificación")
+                            continue
+                        line, data = header_buf.split(b"\n", 1)
+                        if not line.startswith(b"ENC "):
+                            raise ValueError(f"cabecera inesperada: {line[:64]!r}")
+                        decompressor = make_decompressor(line[4:].decode().strip())
+                        header_done = True
+                    if decompressor is not None:
+                        data = decompressor.decompress(data)
+                    write_started = time.monotonic_ns()
+                    f.write(data) # Escribe los datos en el archivo.
+                    disk_ns += time.monotonic_ns() - write_started
+                    feed_blocks(blocks, data)
+
+                # Detección de estancamiento: sin primer byte en el tiempo habitual del peer, o
+                # velocidad muy por debajo de la suya habitual.
+                if not stalled and on_stall:
+                    if started is None and now - requested > first_byte_limit:
+                        stalled = True
+                        print(f"Descarga de {chunk_name} desde {peer_info} estancada "
+                              f"(sin datos tras {now - requested:.1f} s).")
+                        on_stall()
+                    elif started is not None and norm and now - started > STALL_GRACE_PERIOD and \
+                         received / (now - started) < norm * STALL_FACTOR:
+                        stalled = True
+                        print(f"Descarga de {chunk_name} desde {peer_info} estancada "
+                              f"({received / (now - started):.0f} B/s frente a {norm:.0f} B/s habituales).")
+                        on_stall()
+
+            if decompressor is not None:
+                data = decompressor.flush()
+                write_started = time.monotonic_ns()
+                f.write(data)
+                disk_ns += time.monotonic_ns() - write_started
+                feed_blocks(blocks, data)
+        trace_event("last_byte", chunk_name, peer_info, received)
+        trace_event("disk_write", chunk_name, peer_info, disk_ns)
+
+        # Las respuestas cortas que empiezan por "ERROR" son un rechazo del peer, no datos corruptos.
+        if received < 256 and head.startswith(b"ERROR"):
+            print(f"{peer_info} no entregó {chunk_name}: {head.decode(errors='replace')}")
+            os.remove(chunk_path)
+            return False
+        if not header_done:
+            raise ValueError("respuesta incompleta, sin cabecera de codificación")
         print(f"Descargado {chunk_name} desde {peer_ip}:{peer_port}")
 
+        # Si algún bloque no coincide con el manifiesto Merkle, se atribuye al peer que lo envió
+        # y se vuelven a pedir solo esos bloques, empezando por los demás peers.
+        corrupt_blocks, missing_blocks = finish_blocks(blocks)
+        if corrupt_blocks:
+            record_corruption(peer_info, chunk_name, corrupt_blocks)
+        bad_blocks = corrupt_blocks + missing_blocks
+        if bad_blocks:
+            peers_for_repair = [p for p in (repair_peers or []) if p != peer_info] + [peer_info]
+            if not repair_blocks(chunk_path, chunk_name, bad_blocks, peers_for_repair):
+                print(f"No se pudieron reparar los bloques de {chunk_name}.")
+
         # Después de la descarga, verifica la integridad del chunk.
-        if verify_chunk(chunk_path, expected_checksum):
+        trace_event("hash_start", chunk_name, peer_info)
+        verified = verify_chunk(chunk_path, expected_checksum)
+        trace_event("hash_end", chunk_name, peer_info)
+        if verified:
             print(f"Chunk {chunk_name} verificado correctamente.")
-        else:
-            print(f"Chunk {chunk_name} está corrupto. Eliminando y reintentando si es posible.")
-            os.remove(chunk_path) # Borra el archivo corrupto.
+            update_peer_rate(peer_info, received / max(last_data - started, 1e-3))
+            return True
+        print(f"Chunk {chunk_name} está corrupto. Eliminando y reintentando si es posible.")
+        os.remove(chunk_path) # Borra el archivo corrupto.
     except Exception as e:
         print(f"Error al descargar o verificar {chunk_name} desde {peer_ip}:{peer_port}: {e}")
         # Si el archivo se creó pero la descarga falló, intenta limpiar.
         if os.path.exists(chunk_path):
             os.remove(chunk_path)
     finally:
-        s.close() # Asegura que el socket se cierre.
+        if s:
+            s.close() # Asegura que el socket se cierre.
+    return False
+
+# Función para descargar un chunk con reintentos y solicitudes duplicadas (hedged requests).
+# Empieza por el primer candidato; si la transferencia falla se pasa al siguiente, y si se
+# estanca se lanza en paralelo una copia de la solicitud a otro peer. Se conserva la primera
+# copia que termina verificada y se cancelan las demás.
+def download_chunk_hedged(candidates, chunk_name, expected_checksum):
+    chunk_path = os.path.join(CHUNK_DIR, chunk_name)
+    candidates = [peer_info for peer_info in candidates if not is_banned(peer_info)]
+    if not candidates:
+        print(f"No quedan peers fiables para descargar {chunk_name}.")
+        return False
+    cancel_event = threading.Event()
+    state = {"winner": None, "active": 0, "stalls": 0}
+    cond = threading.Condition()
+
+    def on_stall():
+        with cond:
+            state["stalls"] += 1
+            cond.notify()
+
+    # Cada intento avisa siempre al coordinador al terminar, aunque falle de forma inesperada
+    # (p. ej. una entrada mal formada en el tracker), para que nunca se quede esperando.
+    def attempt(peer_info, tmp_path):
+        ok = False
+        try:
+            peer_ip, peer_port = peer_info.rsplit(':', 1)
+            ok = download_chunk(peer_ip.strip("[]"), int(peer_port), chunk_name, expected_checksum,
+                                dest_path=tmp_path, cancel_event=cancel_event, on_stall=on_stall,
+                                repair_peers=candidates)
+        except Exception as e:
+            print(f"Error al descargar {chunk_name} desde {peer_info}: {e}")
+        finally:
+            with cond:
+                try:
+                    if ok and state["winner"] is None:
+                        os.replace(tmp_path, chunk_path)
+                        state["winner"] = peer_info
+                        cancel_event.set()
+                    elif os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                except OSError as e:
+                    print(f"Error al guardar {chunk_name} desde {peer_info}: {e}")
+                state["active"] -= 1
+                cond.notify()
+
+    def launch(index):
+        peer_info = candidates[index]
+        tmp_path = f"{chunk_path}.{index}.tmp"
+        state["active"] += 1
+        threading.Thread(target=attempt, args=(peer_info, tmp_path), daemon=True).start()
+
+    next_index = 0
+    hedges = 0
+    with cond:
+        launch(next_index)
+        next_index += 1
+        while state["winner"] is None:
+            # Con un límite de espera, el coordinador revisa periódicamente el estado aunque
+            # se pierda una notificación.
+            cond.wait(POLL_INTERVAL)
+            if state["winner"] is not None:
+                break
+            more = next_index < len(candidates)
+            if state["active"] == 0:
+                # Todas las transferencias en curso fallaron: reintento con el siguiente peer.
+                if not more:
+                    break
+                launch(next_index)
+                next_index += 1
+            elif state["stalls"] > 0 and more and hedges < MAX_HEDGES:
+                # Alguna transferencia está estancada: se duplica la solicitud en otro peer.
+                state["stalls"] -= 1
+                hedges += 1
+                print(f"Solicitud duplicada de {chunk_name} a {candidates[next_index]}.")
+                launch(next_index)
+                next_index += 1
+            else:
+                state["stalls"] = 0
+
+    trace_event("done", chunk_name, state["winner"] or "", 1 if state["winner"] else 0)
+    if state["winner"] is None:
+        print(f"No se pudo descargar {chunk_name} de ningún peer.")
+        return False
+    print(f"{chunk_name} obtenido desde {state['winner']}.")
+    return True
 
 # Función para reconstruir el archivo completo a partir de los chunks descargados.
 def reconstruct_file(output_filename="received_peli.mp4"):
@@ -165,15 +701,39 @@ def reconstruct_file(output_filename="received_peli.mp4"):
 # que quieren descargar un chunk de este mini-seeder (el leecher actual).
 def handle_incoming_chunk_request(conn, addr):
     try:
-        chunk_name = conn.recv(1024).decode().strip() # Recibe el nombre del chunk solicitado.
+        # Recibe el nombre del chunk solicitado y sus opciones (p. ej. ACCEPT).
+        chunk_name, options = parse_chunk_request(conn.recv(1024).decode())
+        client = f"{addr[0]}:{addr[1]}"
+        trace_event("request", chunk_name, client)
         print(f"Solicitud de chunk '{chunk_name}' de {addr[0]}:{addr[1]}")
         
         path = os.path.join(CHUNK_DIR, chunk_name)
-        if os.path.exists(path):
+        block_range = parse_block_range(options["BLOCKS"]) if "BLOCKS" in options else None
+        if "BLOCKS" in options and block_range is None:
+            conn.sendall(b"ERROR: Rango de bloques incorrecto")
+        elif os.path.basename(chunk_name) == chunk_name and os.path.exists(path) and block_range:
+            # Solicitud de solo algunos bloques (reparación de bloques corruptos de otro peer).
             with open(path, 'rb') as f:
-                while data := f.read(4096):
-                    conn.sendall(data) # Envía el chunk en bloques.
-            print(f"Enviado {chunk_name} a {addr[0]}:{addr[1]}")
+                f.seek(block_range[0])
+                conn.sendall(f.read(block_range[1]))
+            print(f"Enviados bloques {options['BLOCKS']} de {chunk_name} a {addr[0]}:{addr[1]}")
+        elif os.path.basename(chunk_name) == chunk_name and os.path.exists(path):
+            codec, payload = "raw", None
+            if "ACCEPT" in options:
+                codec, payload = get_encoded_chunk(chunk_name, path, parse_accept(options["ACCEPT"]))
+                conn.sendall(f"ENC {codec}\n".encode())
+            trace_event("first_byte", chunk_name, client)
+            sent = 0
+            if payload is not None:
+                conn.sendall(payload)
+                sent = len(payload)
+            else:
+                with open(path, 'rb') as f:
+                    while data := f.read(4096):
+                        conn.sendall(data) # Envía el chunk en bloques.
+                        sent += len(data)
+            trace_event("last_byte", chunk_name, client, sent)
+            print(f"Enviado {chunk_name} a {addr[0]}:{addr[1]} ({codec})")
         else:
             # Si el chunk solicitado no existe localmente, envía un mensaje de error.
             conn.sendall(b"ERROR: Chunk no encontrado.")
@@ -185,12 +745,19 @@ def handle_incoming_chunk_request(conn, addr):
 
 # La función `peer_server` del leecher, que permite que actúe como un mini-seeder.
 # Escucha en su propio puerto (`LEECHER_SERVER_PORT = 6001`) para servir chunks a otros.
-def leecher_peer_server():
+# `ready` (opcional) se activa en cuanto el puerto está abierto; si no se puede abrir, la
+# función termina sin activarlo.
+def leecher_peer_server(ready=None):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
+        # Permite reabrir el puerto enseguida si el lanzador reinicia el leecher.
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind(("", LEECHER_SERVER_PORT)) # Escucha en todas las interfaces de red en LEECHER_SERVER_PORT.
         s.listen(5)             # Permite hasta 5 conexiones pendientes.
         print(f"Mini-seeder del leecher activo en el puerto {LEECHER_SERVER_PORT}")
+        if ready is not None:
+            ready.set()
+        notify_launcher("READY")
 
         while True:
             # Acepta nuevas conexiones entrantes.
@@ -206,33 +773,35 @@ def leecher_peer_server():
 # Informa al tracker qué chunks tiene disponibles para compartir.
 def register_as_seeder(peer_ip, chunks):
     print(f"Registrando como mini-seeder en el tracker {TARGET_IP}:{TRACKER_PORT} con {len(chunks)} chunks...")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        s.connect((TARGET_IP, TRACKER_PORT)) # Conecta al tracker.
         # Construye el mensaje de registro: "REGISTER IP:PUERTO chunk1 chunk2 ..."
         message = f"REGISTER {peer_ip}:{LEECHER_SERVER_PORT} " + " ".join(chunks)
-        s.sendall(message.encode()) # Envía el mensaje.
-        response = s.recv(1024).decode() # Recibe la respuesta del tracker.
+        response = query_tracker(TARGET_IP, TRACKER_PORT, message, CONNECT_TIMEOUT, IDLE_TIMEOUT) # Envía el registro y espera la respuesta.
+        trace_event("announce", peer=f"{TARGET_IP}:{TRACKER_PORT}", value=len(chunks))
         print(f"Respuesta del tracker al registro: {response}")
     except Exception as e:
         print(f"Error al registrar como mini-seeder en el tracker: {e}")
-    finally:
-        s.close() # Cierra el socket.
 
 # Función principal que inicia el proceso del Leecher.
+# Retorna True si se descargaron y verificaron todos los chunks del archivo.
 def start_leecher():
     # 1. Inicia el servidor mini-seeder en un hilo paralelo.
     # Esto permite que el leecher descargue mientras simultáneamente comparte los chunks que ya tiene.
-    threading.Thread(target=leecher_peer_server, daemon=True).start()
-    
-    # Dar un pequeño tiempo para que el mini-seeder inicie.
-    time.sleep(1)
+    ready = threading.Event()
+    server = threading.Thread(target=leecher_peer_server, args=(ready,), daemon=True)
+    server.start()
+
+    # Espera a que el mini-seeder tenga el puerto abierto antes de anunciarse en el tracker.
+    while not ready.wait(POLL_INTERVAL):
+        if not server.is_alive():
+            print("No se pudo iniciar el mini-seeder del leecher.")
+            return False
 
     # 2. Descubre los peers disponibles a través del tracker.
     peers = discover_peers()
     if not peers:
         print("No se encontraron peers en el tracker. No se puede iniciar la descarga.")
-        return
+        return False
 
     # 3. Descarga el archivo de checksums desde el seeder inicial.
     checksums = {}
@@ -252,7 +821,10 @@ def start_leecher():
     
     if not seeder_found or not checksums:
         print("No se pudo obtener checksums de ningún peer o el seeder principal no está activo.")
-        return
+        return False
+
+    # Descarga el manifiesto Merkle para verificar cada bloque según llega (opcional).
+    download_merkle_from_seeder(TARGET_IP, SEEDER_PORT)
 
     # 4. Descarga los chunks que faltan.
     # Itera sobre los checksums para saber qué chunks se necesitan y cuáles son sus hashes esperados.
@@ -264,10 +836,31 @@ def start_leecher():
             chunks_to_download.append((chunk_name, expected_checksum))
 
     print(f"Chunks a descargar: {len(chunks_to_download)}")
-    # Por simplicidad, siempre intenta descargar del `TARGET_IP` (seeder principal) en su puerto `SEEDER_PORT`.
-    # En un sistema P2P real más avanzado, buscarías qué peer tiene este chunk y lo descargarías de él.
-    for chunk_name, expected_checksum in chunks_to_download:
-        download_chunk(TARGET_IP, SEEDER_PORT, chunk_name, expected_checksum)
+    # Cada chunk se pide primero a los peers que lo anuncian en el tracker; el seeder principal
+    # queda como alternativa si las transferencias fallan o se estancan.
+    # La descarga se hace por rondas: un seeder en modo super-seeding solo entrega un chunk
+    # por leecher a la vez, así que los chunks rechazados se reintentan en la siguiente ronda
+    # con la lista de peers actualizada. Tras cada chunk verificado se anuncia al tracker,
+    # lo que permite al seeder ver que el chunk ya se re-comparte.
+    pending = dict(chunks_to_download)
+    available = [name for name in checksums if name not in pending]
+    for chunk_name in pending:
+        trace_event("queue", chunk_name)
+    idle_rounds = 0
+    while pending and idle_rounds < MAX_IDLE_ROUNDS:
+        candidates = build_chunk_candidates(peers, list(pending))
+        progressed = False
+        for chunk_name, expected_checksum in list(pending.items()):
+            if download_chunk_hedged(candidates[chunk_name], chunk_name, expected_checksum):
+                del pending[chunk_name]
+                available.append(chunk_name)
+                register_as_seeder(TARGET_IP, available)
+                progressed = True
+        if pending:
+            idle_rounds = 0 if progressed else idle_rounds + 1
+            print(f"Quedan {len(pending)} chunks; nueva ronda en {ROUND_RETRY_DELAY} s.")
+            time.sleep(ROUND_RETRY_DELAY)
+            peers = discover_peers() or peers
 
     # 5. Obtiene la lista de chunks que el leecher ha descargado y tiene completos y verificados.
     downloaded_chunks = [
@@ -281,12 +874,17 @@ def start_leecher():
     # Usa su propia IP y su puerto de escucha (LEECHER_SERVER_PORT).
     register_as_seeder(TARGET_IP, downloaded_chunks)
 
-    # 7. Reconstruye el archivo completo a partir de los chunks descargados.
+    # 7. Reconstruye el archivo completo a partir de los chunks descargados (solo si están todos).
+    if pending:
+        print(f"Descarga incompleta: faltan {len(pending)} chunks ({', '.join(pending)}).")
+        return False
     reconstruct_file()
 
     print("Proceso de leecher completado.")
+    return True
 
 
 # Punto de entrada principal del script.
+# Termina con código 1 si la descarga no se completó, para que el lanzador lo reinicie.
 if __name__ == "__main__":
-    start_leecher() # Inicia el leecher
+    sys.exit(0 if start_leecher() else 1) # Inicia el leecher
@@ -0,0 +1,466 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import leecher
+from leecher import (
+    CHUNK_DIR, TARGET_IP, SEEDER_PORT, LEECHER_SERVER_PORT,
+    CONNECT_TIMEOUT, IDLE_TIMEOUT, POLL_INTERVAL,
+    STALL_GRACE_PERIOD, STALL_FACTOR, MAX_HEDGES,
+    MAX_IDLE_ROUNDS, ROUND_RETRY_DELAY,
+)
+from common.compression import parse_chunk_request, parse_accept, get_encoded_chunk, make_decompressor
+from common.merkle import parse_block_range
+
+# Motor de descarga asíncrono del Leecher.
+# Todas las conexiones (descargas y mini-seeder) comparten un único event loop en un solo hilo;
+# la escritura en disco y el cálculo de hashes se delegan a un pequeño pool de hilos, ya que
+# `hashlib` y las escrituras de archivos liberan el GIL con bloques grandes.
+
+MAX_CONCURRENT_STREAMS = 256  # Descargas simultáneas en total
+MAX_STREAMS_PER_PEER = 4      # Descargas simultáneas hacia un mismo peer
+DISK_WORKERS = 4              # Hilos para escritura en disco y hashing
+READ_SIZE = 256 * 1024        # Tamaño de cada lectura de socket (256KB)
+ANNOUNCE_INTERVAL = 1         # Segundos mínimos entre anuncios al tracker
+
+# Descomprime (si hace falta) un bloque recibido, lo escribe en el archivo y actualiza el hash
+# incremental del chunk. Se ejecuta en el pool de hilos para no bloquear el event loop.
+# También alimenta la verificación bloque a bloque del manifiesto Merkle, si la hay.
+# Retorna los nanosegundos dedicados a la escritura, para el registro de eventos.
+def write_and_hash(f, sha256, data, decompressor=None, blocks=None):
+    if decompressor is not None:
+        data = decompressor.decompress(data)
+    write_started = time.monotonic_ns()
+    f.write(data)
+    disk_ns = time.monotonic_ns() - write_started
+    sha256.update(data)
+    leecher.feed_blocks(blocks, data)
+    return disk_ns
+
+# Estado compartido por todas las tareas del motor: pool de disco, límites de concurrencia,
+# progreso de cada transferencia (para detectar estancamientos) y anuncios pendientes.
+class DownloadEngine:
+    def __init__(self, executor):
+        self.executor = executor
+        self.streams = asyncio.Semaphore(MAX_CONCURRENT_STREAMS)
+        self.peer_slots = {}
+        self.peer_load = {}  # Intentos en curso o en espera hacia cada peer
+        self.available = []
+        self.announce_event = asyncio.Event()
+
+    def peer_slot(self, peer_info):
+        if peer_info not in self.peer_slots:
+            self.peer_slots[peer_info] = asyncio.Semaphore(MAX_STREAMS_PER_PEER)
+        return self.peer_slots[peer_info]
+
+    # Plaza para una transferencia: una de las MAX_CONCURRENT_STREAMS globales y después una del peer.
+    # Desde que se obtiene la global se anota en `progress["waiting"]`: la espera por la plaza del
+    # peer y por el primer byte cuentan ya para detectar estancamientos (la cola global no, porque
+    # duplicar la solicitud solo la alargaría).
+    @contextlib.asynccontextmanager
+    async def stream_slot(self, peer_info, progress):
+        async with self.streams:
+            progress["waiting"] = time.monotonic()
+            async with self.peer_slot(peer_info):
+                yield
+
+    async def run_blocking(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    # Descarga un chunk de un peer a `tmp_path`. `progress` es un diccionario que la tarea
+    # actualiza con los bytes recibidos para que el coordinador pueda medir su velocidad.
+    # Los bloques corruptos según el manifiesto Merkle se atribuyen a este peer y se vuelven a
+    # pedir a `repair_peers`. Retorna True si el chunk queda con el hash SHA-256 esperado.
+    async def fetch_chunk(self, peer_info, chunk_name, expected_checksum, tmp_path, progress, repair_peers=()):
+        async with self.stream_slot(peer_info, progress):
+            print(f"Descargando {chunk_name} desde {peer_info}...")
+            writer = None
+            f = None
+            try:
+                peer_ip, peer_port = peer_info.rsplit(':', 1)
+                connect_started = time.monotonic_ns()
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(peer_ip.strip("[]"), int(peer_port)), CONNECT_TIMEOUT)
+                leecher.trace_event("connect", chunk_name, peer_info, time.monotonic_ns() - connect_started)
+                writer.write(leecher.chunk_request(chunk_name, peer_info).encode())
+                await writer.drain()
+                leecher.trace_event("request", chunk_name, peer_info)
+                requested = time.monotonic()
+
+                sha256 = hashlib.sha256()
+                f = await self.run_blocking(open, tmp_path, 'wb')
+                decompressor = None
+                if leecher.COMPRESSION_ENABLED:
+                    # La respuesta empieza con "ENC <códec>\n" o es un rechazo "ERROR: ..." sin salto de línea.
+                    try:
+                        line = await asyncio.wait_for(reader.readuntil(b"\n"), IDLE_TIMEOUT)
+                    except asyncio.IncompleteReadError as e:
+                        if e.partial.startswith(b"ERROR"):
+                            print(f"{peer_info} no entregó {chunk_name}: {e.partial.decode(errors='replace')}")
+                        else:
+                            print(f"Respuesta de {peer_info} para {chunk_name} sin cabecera de codificación.")
+                        return await self.discard(tmp_path, f)
+                    if not line.startswith(b"ENC "):
+                        print(f"Cabecera inesperada de {peer_info} para {chunk_name}: {line[:64]!r}")
+                        return await self.discard(tmp_path, f)
+                    decompressor = make_decompressor(line[4:].decode().strip())
+
+                blocks = leecher.new_block_state(chunk_name)
+                head = b""
+                disk_ns = 0
+                while True:
+                    data = await asyncio.wait_for(reader.read(READ_SIZE), IDLE_TIMEOUT)
+                    if not data:
+                        break
+                    if len(head) < 256:
+                        head += data[:256]
+                    if progress["started"] is None:
+                        # Como en el leecher con hilos, la velocidad se mide desde el primer byte.
+                        progress["started"] = time.monotonic()
+                        leecher.update_peer_first_byte(peer_info, progress["started"] - requested)
+                        leecher.trace_event("first_byte", chunk_name, peer_info)
+                    progress["received"] += len(data)
+                    disk_ns += await self.run_blocking(write_and_hash, f, sha256, data, decompressor, blocks)
+                if decompressor is not None:
+                    disk_ns += await self.run_blocking(write_and_hash, f, sha256, decompressor.flush(), None, blocks)
+                await self.run_blocking(f.close)
+                f = None
+                leecher.trace_event("last_byte", chunk_name, peer_info, progress["received"])
+                leecher.trace_event("disk_write", chunk_name, peer_info, disk_ns)
+
+                # El hash se calcula de forma incremental según llegan los datos; aquí solo queda
+                # cerrarlo (y, si hay bloques corruptos, repararlos y volver a verificar).
+                leecher.trace_event("hash_start", chunk_name, peer_info)
+                verified = sha256.hexdigest() == expected_checksum
+                corrupt_blocks, missing_blocks = leecher.finish_blocks(blocks)
+                if not verified and (corrupt_blocks or missing_blocks):
+                    if corrupt_blocks:
+                        leecher.record_corruption(peer_info, chunk_name, corrupt_blocks)
+                    peers_for_repair = [p for p in repair_peers if p != peer_info] + [peer_info]
+                    verified = await self.repair_blocks(
+                        tmp_path, chunk_name, corrupt_blocks + missing_blocks, peers_for_repair) \
+                        and await self.run_blocking(leecher.verify_chunk, tmp_path, expected_checksum)
+                leecher.trace_event("hash_end", chunk_name, peer_info)
+
+                if verified:
+                    elapsed = max(time.monotonic() - (progress["started"] or time.monotonic()), 1e-3)
+                    leecher.update_peer_rate(peer_info, progress["received"] / elapsed)
+                    return True
+                if progress["received"] < 256 and head.startswith(b"ERROR"):
+                    print(f"{peer_info} no entregó {chunk_name}: {head.decode(errors='replace')}")
+                else:
+                    print(f"Chunk {chunk_name} desde {peer_info} está corrupto.")
+            except asyncio.TimeoutError:
+                print(f"Tiempo de espera agotado descargando {chunk_name} desde {peer_info}.")
+            except Exception as e:
+                print(f"Error al descargar {chunk_name} desde {peer_info}: {e}")
+            finally:
+                if f is not None:
+                    await self.run_blocking(f.close)
+                if writer is not None:
+                    writer.close()
+        if os.path.exists(tmp_path):
+            await self.run_blocking(os.remove, tmp_path)
+        return False
+
+    # Cierra y borra el archivo temporal de una descarga fallida. Retorna False.
+    async def discard(self, tmp_path, f):
+        await self.run_blocking(f.close)
+        if os.path.exists(tmp_path):
+            await self.run_blocking(os.remove, tmp_path)
+        return False
+
+    def release_peer(self, peer_info):
+        self.peer_load[peer_info] -= 1
+
+    # Versión asíncrona de `leecher.fetch_blocks`: pide a un peer los bloques `first`..`last`
+    # (incluidos) de un chunk. Retorna los bytes recibidos o None si el peer rechaza la solicitud o falla.
+    async def fetch_blocks(self, peer_info, chunk_name, first, last):
+        writer = None
+        try:
+            peer_ip, peer_port = peer_info.rsplit(':', 1)
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(peer_ip.strip("[]"), int(peer_port)), CONNECT_TIMEOUT)
+            writer.write(f"{chunk_name} BLOCKS={first}-{last} PEER={leecher.own_peer_info()}".encode())
+            await writer.drain()
+            expected = (last - first + 1) * leecher.MERKLE_BLOCK_SIZE
+            data = b""
+            while len(data) < expected:
+                chunk = await asyncio.wait_for(reader.read(READ_SIZE), IDLE_TIMEOUT)
+                if not chunk:
+                    break
+                data += chunk
+            if data.startswith(b"ERROR") and len(data) < 256:
+                print(f"{peer_info} no entregó los bloques {first}-{last} de {chunk_name}: {data.decode(errors='replace')}")
+                return None
+            return data
+        except asyncio.TimeoutError:
+            print(f"Tiempo de espera agotado pidiendo bloques de {chunk_name} a {peer_info}.")
+            return None
+        except Exception as e:
+            print(f"Error al pedir bloques de {chunk_name} a {peer_info}: {e}")
+            return None
+        finally:
+            if writer is not None:
+                writer.close()
+
+    # Versión asíncrona de `leecher.repair_blocks`: las conexiones se hacen en el event loop y
+    # solo la verificación y escritura de cada rango recibido se delega al pool de hilos.
+    async def repair_blocks(self, chunk_path, chunk_name, bad_blocks, peers):
+        leaves = leecher.DOWNLOADED_MERKLE[chunk_name]["leaves"]
+        if any(index >= len(leaves) for index in bad_blocks):
+            return False # El peer envió más datos de los esperados: no se puede reparar por bloques.
+        remaining = sorted(set(bad_blocks))
+        for peer_info in peers:
+            if not remaining:
+                break
+            if leecher.is_banned(peer_info):
+                continue
+            still_bad, corrupt = [], []
+            for first, last in leecher.block_ranges(remaining):
+                data = await self.fetch_blocks(peer_info, chunk_name, first, last)
+                if data is None:
+                    still_bad.extend(range(first, last + 1))
+                    continue
+                bad = await self.run_blocking(leecher.write_repaired_blocks, chunk_path, chunk_name, first, last, data)
+                still_bad.extend(bad)
+                corrupt.extend(bad)
+            remaining = leecher.finish_repair_round(peer_info, chunk_name, remaining, still_bad, corrupt)
+        return not remaining
+
+    # Versión asíncrona de `leecher.download_chunk_hedged`: reintenta con el siguiente peer si
+    # una transferencia falla y duplica la solicitud si se estanca. Gana la primera copia verificada.
+    async def download_chunk_hedged(self, candidates, chunk_name, expected_checksum):
+        chunk_path = os.path.join(CHUNK_DIR, chunk_name)
+        candidates = [peer_info for peer_info in candidates if not leecher.is_banned(peer_info)]
+        if not candidates:
+            print(f"No quedan peers fiables para descargar {chunk_name}.")
+            return False
+        seeder_info = f"{TARGET_IP}:{SEEDER_PORT}"
+        tasks = {}
+        untried = list(candidates)
+        attempts = 0
+        hedges = 0
+
+        # Cada intento va al peer candidato con menos transferencias en curso, y el seeder principal
+        # solo cuando no queda otro: así los chunks de una ronda se reparten entre todos los peers que
+        # los tienen en lugar de hacer cola en el primero de la lista.
+        def launch():
+            nonlocal attempts
+            peer_info = min(untried, key=lambda p: (p == seeder_info, self.peer_load.get(p, 0)))
+            untried.remove(peer_info)
+            tmp_path = f"{chunk_path}.{attempts}.tmp"
+            attempts += 1
+            progress = {"received": 0, "started": None, "waiting": None, "stalled": False,
+                        "peer": peer_info, "tmp": tmp_path,
+                        "norm": leecher.expected_peer_rate(peer_info),
+                        "first_byte_limit": leecher.first_byte_deadline(peer_info)}
+            self.peer_load[peer_info] = self.peer_load.get(peer_info, 0) + 1
+            task = asyncio.create_task(
+                self.fetch_chunk(peer_info, chunk_name, expected_checksum, tmp_path, progress, candidates))
+            task.add_done_callback(lambda _: self.release_peer(peer_info))
+            tasks[task] = progress
+            return peer_info
+
+        launch()
+        winner = None
+        while tasks and winner is None:
+            done, _ = await asyncio.wait(tasks, timeout=POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                progress = tasks.pop(task)
+                if task.result() and winner is None:
+                    await self.run_blocking(os.replace, progress["tmp"], chunk_path)
+                    winner = progress["peer"]
+            if winner is not None:
+                break
+
+            if not tasks:
+                if untried:
+                    launch()
+                continue
+            now = time.monotonic()
+            for progress in list(tasks.values()):
+                if progress["stalled"]:
+                    continue
+                started, waiting, norm = progress["started"], progress["waiting"], progress["norm"]
+                if started is None:
+                    # Aún sin primer byte: esperando plaza del peer, conexión o respuesta.
+                    if waiting is None or now - waiting <= progress["first_byte_limit"]:
+                        continue
+                    reason = f"sin datos tras {now - waiting:.1f} s"
+                else:
+                    if not norm or now - started <= STALL_GRACE_PERIOD:
+                        continue
+                    rate = progress["received"] / (now - started)
+                    if rate >= norm * STALL_FACTOR:
+                        continue
+                    reason = f"{rate:.0f} B/s frente a {norm:.0f} B/s habituales"
+                progress["stalled"] = True
+                print(f"Descarga de {chunk_name} desde {progress['peer']} estancada ({reason}).")
+                if untried and hedges < MAX_HEDGES:
+                    hedges += 1
+                    print(f"Solicitud duplicada de {chunk_name} a {launch()}.")
+
+        # Cancela las copias que siguen en curso; cada tarea borra su archivo temporal.
+        for task in tasks:
+            task.cancel()
+        for task, progress in tasks.items():
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            if os.path.exists(progress["tmp"]):
+                await self.run_blocking(os.remove, progress["tmp"])
+
+        leecher.trace_event("done", chunk_name, winner or "", 1 if winner else 0)
+        if winner is None:
+            print(f"No se pudo descargar {chunk_name} de ningún peer.")
+            return False
+        print(f"{chunk_name} obtenido desde {winner}.")
+        self.available.append(chunk_name)
+        self.announce_event.set()
+        return True
+
+    # Agrupa los anuncios al tracker: como mucho uno cada ANNOUNCE_INTERVAL segundos,
+    # con la lista completa de chunks verificados en ese momento.
+    async def announcer(self):
+        while True:
+            await self.announce_event.wait()
+            self.announce_event.clear()
+            await self.run_blocking(leecher.register_as_seeder, TARGET_IP, list(self.available))
+            await asyncio.sleep(ANNOUNCE_INTERVAL)
+
+    # Mini-seeder asíncrono: atiende solicitudes de otros peers en el mismo event loop.
+    async def handle_incoming_chunk_request(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        f = None
+        try:
+            request = (await asyncio.wait_for(reader.read(1024), IDLE_TIMEOUT)).decode()
+            chunk_name, options = parse_chunk_request(request)
+            client = f"{addr[0]}:{addr[1]}"
+            leecher.trace_event("request", chunk_name, client)
+            print(f"Solicitud de chunk '{chunk_name}' de {addr[0]}:{addr[1]}")
+            path = os.path.join(CHUNK_DIR, chunk_name)
+            block_range = parse_block_range(options["BLOCKS"]) if "BLOCKS" in options else None
+            if "BLOCKS" in options and block_range is None:
+                writer.write(b"ERROR: Rango de bloques incorrecto")
+                await writer.drain()
+            elif os.path.basename(chunk_name) == chunk_name and os.path.exists(path) and block_range:
+                # Solicitud de solo algunos bloques (reparación de bloques corruptos de otro peer).
+                f = await self.run_blocking(open, path, 'rb')
+                await self.run_blocking(f.seek, block_range[0])
+                writer.write(await self.run_blocking(f.read, block_range[1]))
+                await writer.drain()
+                print(f"Enviados bloques {options['BLOCKS']} de {chunk_name} a {addr[0]}:{addr[1]}")
+            elif os.path.basename(chunk_name) == chunk_name and os.path.exists(path):
+                codec, payload = "raw", None
+                if "ACCEPT" in options:
+                    codec, payload = await self.run_blocking(
+                        get_encoded_chunk, chunk_name, path, parse_accept(options["ACCEPT"]))
+                    writer.write(f"ENC {codec}\n".encode())
+                leecher.trace_event("first_byte", chunk_name, client)
+                sent = 0
+                if payload is not None:
+                    writer.write(payload)
+                    await writer.drain()
+                    sent = len(payload)
+                else:
+                    f = await self.run_blocking(open, path, 'rb')
+                    while data := await self.run_blocking(f.read, READ_SIZE):
+                        writer.write(data)
+                        await writer.drain()
+                        sent += len(data)
+                leecher.trace_event("last_byte", chunk_name, client, sent)
+                print(f"Enviado {chunk_name} a {addr[0]}:{addr[1]} ({codec})")
+            else:
+                writer.write(b"ERROR: Chunk no encontrado.")
+                await writer.drain()
+                print(f"Chunk '{chunk_name}' no encontrado para {addr[0]}:{addr[1]}")
+        except Exception as e:
+            print(f"Error al manejar la solicitud de chunk entrante de {addr[0]}:{addr[1]}: {e}")
+        finally:
+            if f is not None:
+                await self.run_blocking(f.close)
+            writer.close()
+
+# Flujo principal del leecher asíncrono. Sigue los mismos pasos que `leecher.start_leecher`,
+# pero descarga todos los chunks pendientes de una ronda de forma concurrente.
+# Retorna True si se descargaron y verificaron todos los chunks del archivo.
+async def run_leecher():
+    executor = ThreadPoolExecutor(max_workers=DISK_WORKERS)
+    engine = DownloadEngine(executor)
+    server = await asyncio.start_server(engine.handle_incoming_chunk_request, "", LEECHER_SERVER_PORT, backlog=512)
+    print(f"Mini-seeder del leecher activo en el puerto {LEECHER_SERVER_PORT}")
+    leecher.notify_launcher("READY")
+    announcer = asyncio.create_task(engine.announcer())
+    try:
+        peers = await engine.run_blocking(leecher.discover_peers)
+        if not peers:
+            print("No se encontraron peers en el tracker. No se puede iniciar la descarga.")
+            return False
+
+        seeder_info = f"{TARGET_IP}:{SEEDER_PORT}"
+        if seeder_info not in peers:
+            print("No se pudo obtener checksums de ningún peer o el seeder principal no está activo.")
+            return False
+        checksums = await engine.run_blocking(leecher.download_checksums_from_seeder, TARGET_IP, SEEDER_PORT)
+        if not checksums:
+            print("No se pudo obtener checksums de ningún peer o el seeder principal no está activo.")
+            return False
+        await engine.run_blocking(leecher.download_merkle_from_seeder, TARGET_IP, SEEDER_PORT)
+
+        pending = {}
+        for chunk_name, expected_checksum in checksums.items():
+            chunk_path = os.path.join(CHUNK_DIR, chunk_name)
+            if os.path.exists(chunk_path) and \
+               await engine.run_blocking(leecher.verify_chunk, chunk_path, expected_checksum):
+                engine.available.append(chunk_name)
+            else:
+                pending[chunk_name] = expected_checksum
+        print(f"Chunks a descargar: {len(pending)}")
+        for chunk_name in pending:
+            leecher.trace_event("queue", chunk_name)
+
+        idle_rounds = 0
+        while pending and idle_rounds < MAX_IDLE_ROUNDS:
+            candidates = await engine.run_blocking(leecher.build_chunk_candidates, peers, list(pending))
+            names = list(pending)
+            results = await asyncio.gather(*(
+                engine.download_chunk_hedged(candidates[name], name, pending[name]) for name in names))
+            for name, ok in zip(names, results):
+                if ok:
+                    del pending[name]
+            if pending:
+                idle_rounds = 0 if any(results) else idle_rounds + 1
+                print(f"Quedan {len(pending)} chunks; nueva ronda en {ROUND_RETRY_DELAY} s.")
+                await asyncio.sleep(ROUND_RETRY_DELAY)
+                peers = await engine.run_blocking(leecher.discover_peers) or peers
+
+        print(f"Chunks descargados y verificados listos para compartir: {engine.available}")
+        await engine.run_blocking(leecher.register_as_seeder, TARGET_IP, list(engine.available))
+        if pending:
+            print(f"Descarga incompleta: faltan {len(pending)} chunks ({', '.join(pending)}).")
+            return False
+        await engine.run_blocking(leecher.reconstruct_file)
+        print("Proceso de leecher completado.")
+        return True
+    finally:
+        announcer.cancel()
+        server.close()
+        await server.wait_closed()
+        executor.shutdown(wait=False)
+
+# Función principal que inicia el Leecher con el motor asíncrono.
+# Retorna True si la descarga se completó.
+def start_leecher_async():
+    return asyncio.run(run_leecher())
+
+# Punto de entrada principal del script.
+# Termina con código 1 si la descarga no se completó, para que el lanzador lo reinicie.
+if __name__ == "__main__":
+    sys.exit(0 if start_leecher_async() else 1)
@@ -1,5 +1,7 @@
 import socket
 import subprocess
+import select
+import signal
 import time
 import sys
 import os
@@ -14,6 +16,13 @@ LEECHER_PORT = 6001  # Puerto para el servidor del leecher (como mini-seeder)
 TRACKER_SCRIPT = r'./src/tracker/tracker.py'
 SEEDER_SCRIPT = r'./src/seeder/seeder.py'
 LEECHER_SCRIPT = r'./src/leecher/leecher.py'
+LEECHER_ASYNC_SCRIPT = r'./src/leecher/leecher_async.py'
+
+# Motor de descarga del leecher: "threads" (un hilo por transferencia, `leecher.py`) o "async"
+# (todas las transferencias en un event loop, `leecher_async.py`, para cientos de conexiones).
+# Se puede elegir sin editar el archivo con la variable de entorno P2P_LEECHER_ENGINE.
+LEECHER_ENGINE = os.environ.get("P2P_LEECHER_ENGINE", "threads")
+LEECHER_SCRIPTS = {"threads": LEECHER_SCRIPT, "async": LEECHER_ASYNC_SCRIPT}
 
 # La dirección IP a la que los clientes (seeder/leecher) se conectarán para el tracker
 # y entre ellos. Has cambiado 'localhost' a esta IP específica.
@@ -31,67 +40,208 @@ def check_port(ip, port):
     except (socket.timeout, socket.error):
         return False # El puerto está libre
 
+# Descripción de cada componente que lanza main.py, en orden de arranque.
+# - "depends": componentes que deben estar listos antes de lanzar este.
+# - "ready_timeout": segundos máximos de espera a que el componente avise que está listo.
+#   El seeder tiene un margen amplio porque antes de escuchar divide el archivo en chunks.
+# - "restart": "always" para servicios que deben seguir vivos (tracker, seeder) y
+#   "on-failure" para el leecher, que termina con código 0 cuando completa la descarga.
+COMPONENTS = [
+    {"name": "tracker", "script": TRACKER_SCRIPT, "port": TRACKER_PORT,
+     "depends": [], "ready_timeout": 15, "restart": "always"},
+    {"name": "seeder", "script": SEEDER_SCRIPT, "port": SEEDER_PORT,
+     "depends": ["tracker"], "ready_timeout": 900, "restart": "always"},
+    {"name": "leecher", "script": LEECHER_SCRIPTS.get(LEECHER_ENGINE), "port": LEECHER_PORT,
+     "depends": ["tracker", "seeder"], "ready_timeout": 30, "restart": "on-failure"},
+]
+
+# Reinicio de componentes caídos con espera exponencial: 1 s, 2 s, 4 s... hasta RESTART_MAX_DELAY.
+# Si un componente se mantiene vivo más de RESTART_RESET_AFTER segundos, la espera vuelve a 1 s.
+RESTART_BASE_DELAY = 1
+RESTART_MAX_DELAY = 30
+RESTART_RESET_AFTER = 60
+SUPERVISE_INTERVAL = 0.5
+
+# Los componentes avisan que están listos escribiendo en un pipe cuyo descriptor reciben en
+# la variable de entorno P2P_READY_FD. En Windows no se pueden heredar descriptores con
+# `pass_fds`, así que allí se comprueba en su lugar que el puerto del componente ya acepte conexiones.
+USE_READY_PIPE = os.name == "posix"
+
 # Función para ejecutar un script Python como un proceso separado.
-# Esto permite que el tracker, seeder y leecher se ejecuten concurrentemente.
+# Retorna el proceso lanzado y el extremo de lectura del pipe de aviso (o None si no se usa).
 def run_script(script_path):
     if not os.path.exists(script_path):
         print(f"Error: El script no existe en la ruta especificada: {script_path}")
-        return False
+        return None, None
     try:
         # sys.executable asegura que el script se ejecute con el mismo intérprete Python
         # que está ejecutando main.py
-        subprocess.Popen([sys.executable, script_path])
-        print(f"Ejecutando {script_path}...")
-        return True
+        if USE_READY_PIPE:
+            read_fd, write_fd = os.pipe()
+            env = dict(os.environ, P2P_READY_FD=str(write_fd))
+            process = subprocess.Popen([sys.executable, script_path], env=env, pass_fds=(write_fd,))
+            os.close(write_fd) # Solo el hijo conserva el extremo de escritura.
+        else:
+            read_fd = None
+            process = subprocess.Popen([sys.executable, script_path])
+        print(f"Ejecutando {script_path} (PID {process.pid})...")
+        return process, read_fd
     except Exception as e:
         print(f"Error al ejecutar {script_path}: {e}")
+        return None, None
+
+# Función para esperar a que un componente recién lanzado avise que está listo.
+# Retorna True si avisó a tiempo y False si terminó antes o se agotó el tiempo de espera.
+def wait_until_ready(component, process, read_fd):
+    name = component["name"]
+    deadline = time.monotonic() + component["ready_timeout"]
+    buffer = b""
+    try:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                print(f"El {name} terminó (código {process.returncode}) antes de estar listo.")
+                return False
+            if read_fd is None:
+                if check_port(TARGET_IP, component["port"]):
+                    return True
+                time.sleep(SUPERVISE_INTERVAL)
+                continue
+
+            readable, _, _ = select.select([read_fd], [], [], SUPERVISE_INTERVAL)
+            if not readable:
+                continue
+            data = os.read(read_fd, 4096)
+            if not data:
+                # Todos los extremos de escritura se cerraron: el componente terminó sin avisar.
+                process.wait()
+                print(f"El {name} terminó (código {process.returncode}) antes de estar listo.")
+                return False
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                message = line.decode(errors="replace").strip()
+                if message == "READY":
+                    return True
+                if message.startswith("STATUS "):
+                    print(f"[{name}] {message[len('STATUS '):]}")
+        print(f"El {name} no avisó que estaba listo en {component['ready_timeout']} s.")
         return False
+    finally:
+        if read_fd is not None:
+            os.close(read_fd)
+
+# Función para lanzar un componente y esperar a que esté listo.
+# El proceso se guarda en `state` nada más lanzarlo, antes de esperar el aviso, para que
+# `stop_all` lo detenga aunque el lanzador reciba SIGTERM durante el arranque.
+# Retorna True si el componente quedó listo; si no, lo detiene y deja `state["process"]` en None.
+def start_component(component, state):
+    process, read_fd = run_script(component["script"])
+    state["process"] = process
+    state["started_at"] = time.monotonic()
+    if process is None:
+        return False
+    if not wait_until_ready(component, process, read_fd):
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        state["process"] = None
+        return False
+    print(f"El {component['name']} está listo.")
+    return True
+
+# Función para detener todos los procesos lanzados.
+def stop_all(running):
+    for name, state in running.items():
+        process = state["process"]
+        if process and process.poll() is None:
+            print(f"Deteniendo {name}...")
+            process.terminate()
+    for state in running.values():
+        if state["process"]:
+            try:
+                state["process"].wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                state["process"].kill()
+
+# Función que vigila los procesos lanzados y reinicia los que caen, con espera exponencial.
+# Termina cuando ya no queda ningún componente en marcha ni pendiente de reinicio.
+def supervise(running):
+    while any(state["process"] or state["restart_at"] is not None for state in running.values()):
+        time.sleep(SUPERVISE_INTERVAL)
+        now = time.monotonic()
+        for component in COMPONENTS:
+            state = running[component["name"]]
+            process = state["process"]
+            if process is None:
+                if state["restart_at"] is not None and now >= state["restart_at"]:
+                    state["restart_at"] = None
+                    if not start_component(component, state):
+                        schedule_restart(component, state)
+                continue
+
+            if process.poll() is None:
+                if now - state["started_at"] > RESTART_RESET_AFTER:
+                    state["delay"] = RESTART_BASE_DELAY
+                continue
+
+            code = process.returncode
+            state["process"] = None
+            if component["restart"] == "on-failure" and code == 0:
+                print(f"El {component['name']} terminó correctamente.")
+                continue
+            print(f"El {component['name']} terminó inesperadamente (código {code}).")
+            schedule_restart(component, state)
+
+# Programa el reinicio de un componente caído y duplica su espera para el siguiente fallo.
+def schedule_restart(component, state):
+    print(f"Reiniciando {component['name']} en {state['delay']} s...")
+    state["restart_at"] = time.monotonic() + state["delay"]
+    state["delay"] = min(state["delay"] * 2, RESTART_MAX_DELAY)
 
 # Función principal para coordinar el inicio de los componentes de la aplicación P2P.
+# Cada componente se lanza cuando sus dependencias ya avisaron que están listas,
+# sin esperas fijas, y después se supervisan todos hasta que el usuario pulse Ctrl+C.
 def main():
-    print("Verificando puertos...\n")
-
-    # === Verificación e inicio del Tracker ===
-    # El tracker debe ser el primero en iniciarse y estar disponible.
-    if check_port(TARGET_IP, TRACKER_PORT):
-        print(f"El puerto {TRACKER_PORT} ya está ocupado en {TARGET_IP}. Asegúrate de que el tracker no se esté ejecutando.")
-        return # Salir si el tracker ya está corriendo o el puerto está ocupado
+    if LEECHER_ENGINE not in LEECHER_SCRIPTS:
+        print(f"Motor de leecher desconocido: {LEECHER_ENGINE} (opciones: {', '.join(LEECHER_SCRIPTS)}).")
+        return 1
 
-    print(f"El puerto {TRACKER_PORT} en {TARGET_IP} está libre. Iniciando el tracker...")
-    if not run_script(TRACKER_SCRIPT):
-        print("No se pudo iniciar el tracker. Abortando.")
-        return
-
-    # Esperar un poco para que el tracker tenga tiempo de inicializarse y empezar a escuchar.
-    time.sleep(2)
-
-    # === Verificación e inicio del Seeder ===
-    # El seeder se registra con el tracker y empieza a ofrecer archivos.
-    if check_port(TARGET_IP, SEEDER_PORT):
-        print(f"El puerto {SEEDER_PORT} ya está ocupado en {TARGET_IP}. Asegúrate de que el seeder no se esté ejecutando.")
-        return
-
-    print(f"El puerto {SEEDER_PORT} en {TARGET_IP} está libre. Iniciando el seeder...")
-    if not run_script(SEEDER_SCRIPT):
-        print("No se pudo iniciar el seeder. Abortando.")
-        return
-
-    # Esperar un poco antes de iniciar el leecher para que el seeder se registre.
-    time.sleep(2)
-
-    # === Verificación e inicio del Leecher ===
-    # El leecher se conecta al tracker para descubrir peers y descargar chunks.
-    # También se convierte en un mini-seeder de los chunks que ya tiene.
-    if check_port(TARGET_IP, LEECHER_PORT):
-        print(f"El puerto {LEECHER_PORT} ya está ocupado en {TARGET_IP}. Asegúrate de que el leecher no se esté ejecutando.")
-        return
+    print("Verificando puertos...\n")
+    for component in COMPONENTS:
+        if check_port(TARGET_IP, component["port"]):
+            print(f"El puerto {component['port']} ya está ocupado en {TARGET_IP}. "
+                  f"Asegúrate de que el {component['name']} no se esté ejecutando.")
+            return 1
+        print(f"El puerto {component['port']} en {TARGET_IP} está libre.")
 
-    print(f"El puerto {LEECHER_PORT} en {TARGET_IP} está libre. Iniciando el leecher...")
-    if not run_script(LEECHER_SCRIPT):
-        print("No se pudo iniciar el leecher. Abortando.")
-        return
+    # SIGTERM detiene el lanzador igual que Ctrl+C, deteniendo también a los componentes.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-    print("\nTodos los scripts se han ejecutado correctamente. Por favor, revisa las ventanas de terminal para cada script para ver su progreso.")
+    running = {}
+    try:
+        for component in COMPONENTS:
+            missing = [dep for dep in component["depends"] if not running.get(dep, {}).get("process")]
+            if missing:
+                print(f"No se puede iniciar el {component['name']}: faltan {', '.join(missing)}.")
+                return 1
+
+            print(f"\nIniciando el {component['name']}...")
+            state = {"process": None, "started_at": None, "delay": RESTART_BASE_DELAY, "restart_at": None}
+            running[component["name"]] = state
+            if not start_component(component, state):
+                print(f"No se pudo iniciar el {component['name']}. Abortando.")
+                return 1
+
+        print("\nTodos los componentes están listos. Pulsa Ctrl+C para detenerlos.")
+        supervise(running)
+    except KeyboardInterrupt:
+        print("\nDeteniendo componentes...")
+    finally:
+        stop_all(running)
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
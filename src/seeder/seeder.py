@@ -3,6 +3,19 @@ import os
 import time
 import hashlib
 import threading
+import ast
+import multiprocessing
+import signal
+import sys
+
+# Los módulos compartidos entre componentes están en `src/common`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import compression
+from common.compression import parse_chunk_request, parse_accept, get_encoded_chunk
+from common.launcher import notify_launcher
+from common.merkle import merkle_root, merkle_leaves, parse_block_range
+from common.tracing import create_recorder
+from common.tracker_client import query_tracker
 
 # Parámetros de configuración del Seeder
 TRACKER_PORT = 8000         # Puerto del tracker al que el seeder se conectará para registrarse
@@ -21,6 +34,52 @@ VIDEO_FILE = './src/seeder/frieren.jpeg'
 CHUNK_DIR = "chunks_seeder" # Cambiado a 'chunks_seeder' para evitar colisiones con el leecher
 os.makedirs(CHUNK_DIR, exist_ok=True) # Asegura que el directorio de chunks exista.
 
+# Segundos entre re-registros periódicos en el tracker.
+ANNOUNCE_INTERVAL = 300
+
+# Modo super-seeding: el seeder inicial ofrece cada chunk a un solo leecher a la vez y no
+# libera más chunks para ese leecher hasta ver, en los anuncios del tracker, que el chunk
+# ya lo comparte otro peer. Así cada chunk sale del seeder inicial casi una sola vez.
+SUPER_SEEDING = False
+SUPER_SEED_POLL_INTERVAL = 5    # Segundos entre consultas al tracker para ver qué chunks se re-comparten
+SUPER_SEED_OFFER_TIMEOUT = 60   # Segundos tras los que una oferta no re-compartida se libera para otro leecher
+# Segundos que un mismo leecher puede estar pidiendo un chunk ya re-compartido antes de que el seeder
+# se lo sirva igualmente: si sigue pidiéndolo es que no lo consigue de quien lo anuncia (p. ej. un
+# leecher caído que el tracker aún no ha caducado). Menor que el tiempo que un leecher insiste
+# antes de rendirse (MAX_IDLE_ROUNDS * ROUND_RETRY_DELAY en el leecher).
+SUPER_SEED_RESHARE_TIMEOUT = 10
+
+# Estado del super-seeding, compartido entre los hilos que atienden a los clientes y el monitor.
+# Los leechers se identifican por el "IP:PUERTO" que anuncian en el tracker (opción PEER de la
+# solicitud), ya que varios leechers pueden compartir IP; sin esa opción se usa la IP de origen.
+# - "offers": leecher -> (chunk ofrecido, instante de la oferta)
+# - "reshared": chunks que algún otro peer anuncia actualmente en el tracker
+# - "refused": (leecher, chunk) -> instante del primer rechazo por estar re-compartido
+SUPER_SEED_STATE = {"active": False, "parts": [], "offers": {}, "reshared": set(), "refused": {}}
+SUPER_SEED_LOCK = threading.Lock()
+# Número de veces que el seeder ha enviado cada chunk (para medir el ahorro de subida).
+UPLOAD_COUNTS = {}
+
+# Número de procesos worker que sirven chunks. Con más de uno, todos escuchan en PEER_PORT
+# mediante SO_REUSEPORT y el kernel reparte las conexiones entre ellos, de modo que el
+# envío de chunks aprovecha varios núcleos en lugar de uno solo limitado por el GIL.
+# Cada worker tiene su propia caché de chunks comprimidos (un chunk muy pedido se comprime una
+# vez por worker); para no multiplicar la memoria, `compression.COMPRESSED_CACHE_BYTES` se reparte entre ellos.
+SEEDER_WORKERS = 1
+WORKER_RESTART_DELAY = 1       # Espera inicial (s) antes de relanzar un worker caído; se duplica en cada fallo seguido
+WORKER_MAX_RESTART_DELAY = 30  # Espera máxima (s) entre reinicios de un mismo worker
+WORKER_STABLE_TIME = 60        # Segundos en marcha tras los que un worker deja de contar como fallido
+WORKER_MAX_FAILURES = 5        # Fallos seguidos tras los que se deja de relanzar un worker
+
+# Índice de chunks servibles: nombre -> ruta en disco. Se construye una sola vez tras dividir
+# el archivo y se pasa a cada worker, que así comparten el mismo manifiesto.
+CHUNK_INDEX = {}
+
+# Registro de eventos para `src/trace_timeline.py` (ver `common/tracing.py`);
+# se activa con la variable de entorno P2P_TRACE_DIR.
+TRACER = create_recorder("seeder", f"seeder@{TARGET_IP}:{PEER_PORT}")
+trace_event = TRACER.event
+
 # Función para calcular el hash SHA-256 de un archivo dado.
 # Es crucial para verificar la integridad de los chunks en el lado del leecher.
 def calculate_sha256(file_path):
@@ -35,6 +94,7 @@ def calculate_sha256(file_path):
 def split_file(filepath):
     parts = []      # Lista para almacenar los nombres de los chunks creados.
     checksums = {}  # Diccionario para almacenar los checksums (nombre_chunk: hash).
+    merkle = {}     # Diccionario con las hojas del árbol de Merkle de cada chunk.
 
     print(f"Dividiendo archivo {filepath} en chunks...")
     if not os.path.exists(filepath):
@@ -54,8 +114,11 @@ def split_file(filepath):
                     p.write(chunk)
 
                 # Calcula el SHA-256 del chunk recién guardado.
+                trace_event("hash_start", part_name)
                 checksum = calculate_sha256(part_path)
                 checksums[part_name] = checksum # Almacena el checksum.
+                merkle[part_name] = merkle_leaves(chunk) # Hashes por bloque para verificar antes y reparar por partes.
+                trace_event("hash_end", part_name)
                 parts.append(part_name)         # Añade el nombre del chunk a la lista.
                 index += 1
         print(f"Archivo dividido en {index} chunks.")
@@ -68,6 +131,15 @@ def split_file(filepath):
                 f.write(f"{name} {chksum}\n")
         print(f"Checksums guardados en {checksums_filepath}")
 
+        # Guarda el manifiesto Merkle en `merkle.txt`, con una línea por chunk:
+        # "nombre_chunk raíz hoja_0,hoja_1,...". Los leechers comprueban que las hojas
+        # reproducen la raíz y después verifican cada bloque según llega.
+        merkle_filepath = os.path.join(CHUNK_DIR, "merkle.txt")
+        with open(merkle_filepath, 'w') as f:
+            for name, leaves in merkle.items():
+                f.write(f"{name} {merkle_root(leaves)} {','.join(leaves)}\n")
+        print(f"Manifiesto Merkle guardado en {merkle_filepath}")
+
     except Exception as e:
         print(f"Error al dividir el archivo: {e}")
         return [] # Retorna una lista vacía si falla la división.
@@ -77,38 +149,143 @@ def split_file(filepath):
 # Función para registrar el seeder en el tracker.
 # Informa al tracker sobre su IP:PUERTO y los archivos (chunks) que ofrece.
 def register_peer(peer_ip, peer_port, file_list):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        # Conecta al tracker.
         print(f"Registrando seeder en tracker {TARGET_IP}:{TRACKER_PORT}...")
-        s.connect((TARGET_IP, TRACKER_PORT)) 
         # Construye el mensaje de registro: "REGISTER IP:PUERTO archivo1 archivo2 ..."
         registration_message = f"REGISTER {peer_ip}:{peer_port} " + " ".join(file_list)
-        s.sendall(registration_message.encode()) # Envía el mensaje de registro.
-        response = s.recv(1024).decode()         # Recibe la respuesta del tracker.
+        response = query_tracker(TARGET_IP, TRACKER_PORT, registration_message) # Envía el registro y espera la respuesta.
+        trace_event("announce", peer=f"{TARGET_IP}:{TRACKER_PORT}", value=len(file_list))
         print(f"Respuesta del tracker al registro: {response}")
     except Exception as e:
         print(f"Error al registrar el seeder en el tracker: {e}")
-    finally:
-        s.close() # Asegura que el socket se cierre.
+
+# Función que decide si, en modo super-seeding, se puede servir `part_name` al leecher `client`.
+# Retorna None si se permite el envío o un mensaje de error para el cliente en caso contrario.
+def super_seed_check(part_name, client):
+    with SUPER_SEED_LOCK:
+        if not SUPER_SEED_STATE["active"] or part_name not in SUPER_SEED_STATE["parts"]:
+            return None
+
+        now = time.monotonic()
+        if part_name in SUPER_SEED_STATE["reshared"]:
+            refused = SUPER_SEED_STATE["refused"]
+            first = refused.setdefault((client, part_name), now)
+            if now - first < SUPER_SEED_RESHARE_TIMEOUT:
+                return "ERROR: Super-seeding, chunk disponible en otros peers"
+            # El leecher no consigue el chunk de quien lo anuncia: se le sirve desde aquí.
+            del refused[(client, part_name)]
+            return None
+
+        offers = SUPER_SEED_STATE["offers"]
+        current = offers.get(client)
+        if current and current[0] == part_name:
+            return None
+        if current and now - current[1] < SUPER_SEED_OFFER_TIMEOUT:
+            return f"ERROR: Super-seeding, chunk asignado {current[0]}"
+        for peer, (offered, since) in offers.items():
+            if offered == part_name and peer != client and now - since < SUPER_SEED_OFFER_TIMEOUT:
+                return "ERROR: Super-seeding, chunk ofrecido a otro peer"
+
+        # El leecher no tiene oferta pendiente y nadie más tiene este chunk: se le asigna.
+        offers[client] = (part_name, now)
+        return None
+
+# Hilo que consulta periódicamente el tracker para ver qué chunks anuncian los demás peers.
+# Un chunk anunciado por otro peer ya circula por el enjambre: se libera la oferta del leecher
+# que lo tenía asignado y el seeder deja de servirlo. Cuando todos los chunks circulan,
+# el super-seeding termina y el seeder vuelve a servir de forma normal.
+def super_seed_monitor(own_info):
+    while True:
+        time.sleep(SUPER_SEED_POLL_INTERVAL)
+        try:
+            peers_list = ast.literal_eval(query_tracker(TARGET_IP, TRACKER_PORT, "DISCOVER"))
+            reshared = set()
+            for peer_info in peers_list:
+                if peer_info == own_info:
+                    continue
+                response = query_tracker(TARGET_IP, TRACKER_PORT, f"GET_CHUNKS {peer_info}")
+                if response and response != "Peer no encontrado.":
+                    reshared.update(response.split(","))
+        except Exception as e:
+            print(f"Error al consultar el tracker para super-seeding: {e}")
+            continue
+
+        with SUPER_SEED_LOCK:
+            SUPER_SEED_STATE["reshared"] = reshared
+            now = time.monotonic()
+            offers = SUPER_SEED_STATE["offers"]
+            for peer, (offered, since) in list(offers.items()):
+                if offered in reshared or now - since >= SUPER_SEED_OFFER_TIMEOUT:
+                    del offers[peer]
+            # Los rechazos de chunks que ya nadie anuncia dejan de contar.
+            refused = SUPER_SEED_STATE["refused"]
+            for key in [key for key in refused if key[1] not in reshared]:
+                del refused[key]
+            if reshared.issuperset(SUPER_SEED_STATE["parts"]):
+                SUPER_SEED_STATE["active"] = False
+                uploads = sum(UPLOAD_COUNTS.values())
+                print(f"Super-seeding completado: {len(SUPER_SEED_STATE['parts'])} chunks "
+                      f"distribuidos con {uploads} envíos desde el seeder.")
+                return
+
+# Hilo que vuelve a registrar el seeder en el tracker cada ANNOUNCE_INTERVAL segundos.
+# Mantiene fresco su registro (el tracker caduca a los peers inactivos) y lo repone
+# si el tracker se reinicia sin estado.
+def announce_loop(peer_ip, peer_port, file_list):
+    while True:
+        time.sleep(ANNOUNCE_INTERVAL)
+        register_peer(peer_ip, peer_port, file_list)
 
 # Función para manejar las solicitudes entrantes de chunks de otros peers.
 # Se ejecuta en un hilo separado por cada conexión para no bloquear el servidor.
 def handle_client_request(conn, addr):
+    client = f"{addr[0]}:{addr[1]}"
+    trace_event("connect", peer=client)
     try:
-        # Recibe el nombre del chunk solicitado por el cliente.
-        part_name = conn.recv(1024).decode().strip() 
+        # Recibe el nombre del chunk solicitado por el cliente y sus opciones (p. ej. ACCEPT).
+        part_name, options = parse_chunk_request(conn.recv(1024).decode())
+        trace_event("request", part_name, client)
         print(f"Solicitud de chunk '{part_name}' de {addr[0]}:{addr[1]}")
         
-        # Construye la ruta completa al chunk en el directorio local.
-        path = os.path.join(CHUNK_DIR, part_name)
-        
-        if os.path.exists(path):
-            with open(path, 'rb') as f:
-                # Lee el chunk en bloques y lo envía al cliente.
-                while data := f.read(4096):
-                    conn.sendall(data) 
-            print(f"Enviado {part_name} a {addr[0]}:{addr[1]}")
+        # Busca la ruta del chunk en el índice de chunks del seeder.
+        path = CHUNK_INDEX.get(part_name)
+
+        # En modo super-seeding puede que este chunk no se le ofrezca a este cliente.
+        refusal = super_seed_check(part_name, options.get("PEER") or addr[0])
+        if refusal:
+            conn.sendall(refusal.encode())
+            print(f"Chunk '{part_name}' retenido para {addr[0]}:{addr[1]}: {refusal}")
+        elif path and os.path.exists(path) and "BLOCKS" in options:
+            # Solicitud de solo algunos bloques (reparación de bloques corruptos): se envían sin comprimir.
+            block_range = parse_block_range(options["BLOCKS"])
+            if block_range is None:
+                conn.sendall(b"ERROR: Rango de bloques incorrecto")
+            else:
+                if "ACCEPT" in options:
+                    conn.sendall(b"ENC raw\n")
+                trace_event("first_byte", part_name, client)
+                with open(path, 'rb') as f:
+                    sent = conn.sendfile(f, offset=block_range[0], count=block_range[1])
+                trace_event("last_byte", part_name, client, sent)
+                print(f"Enviados bloques {options['BLOCKS']} de {part_name} a {addr[0]}:{addr[1]}")
+        elif path and os.path.exists(path):
+            codec, payload = "raw", None
+            if "ACCEPT" in options:
+                codec, payload = get_encoded_chunk(part_name, path, parse_accept(options["ACCEPT"]))
+                conn.sendall(f"ENC {codec}\n".encode())
+            trace_event("first_byte", part_name, client)
+            if payload is not None:
+                conn.sendall(payload)
+                sent = len(payload)
+            else:
+                with open(path, 'rb') as f:
+                    # Envía el chunk con `sendfile`, que copia del archivo al socket en el kernel
+                    # (sin pasar los bytes por Python) cuando el sistema operativo lo permite.
+                    sent = conn.sendfile(f)
+            trace_event("last_byte", part_name, client, sent)
+            with SUPER_SEED_LOCK:
+                UPLOAD_COUNTS[part_name] = UPLOAD_COUNTS.get(part_name, 0) + 1
+            print(f"Enviado {part_name} a {addr[0]}:{addr[1]} ({codec})")
         else:
             # Si el chunk no existe, envía un mensaje de error.
             conn.sendall(b"ERROR: Archivo no encontrado")
@@ -120,13 +297,21 @@ def handle_client_request(conn, addr):
 
 # Función principal del servidor del seeder.
 # Escucha conexiones entrantes en el PEER_PORT para servir chunks.
-def peer_server():
+# Con `reuse_port=True` el socket se abre con SO_REUSEPORT para compartir el puerto con
+# otros procesos worker del seeder.
+def peer_server(reuse_port=False):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
+        # En sistemas POSIX, SO_REUSEADDR permite reabrir el puerto tras un reinicio del seeder.
+        if os.name == "posix":
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         # Vincula el socket a todas las interfaces de red en el PEER_PORT.
         s.bind(("", PEER_PORT)) 
         s.listen(10) # Permite hasta 10 conexiones pendientes en la cola.
         print(f"Seeder escuchando en el puerto {PEER_PORT}")
+        notify_launcher("READY")
         
         while True:
             # Acepta una nueva conexión entrante.
@@ -140,19 +325,116 @@ def peer_server():
     finally:
         s.close() # Asegura que el socket del servidor se cierre.
 
+# Función para construir el índice de chunks (incluido checksums.txt) a partir de los chunks generados.
+def build_chunk_index(parts):
+    index = {name: os.path.join(CHUNK_DIR, name) for name in parts}
+    index["checksums.txt"] = os.path.join(CHUNK_DIR, "checksums.txt")
+    index["merkle.txt"] = os.path.join(CHUNK_DIR, "merkle.txt")
+    return index
+
+# Punto de entrada de cada proceso worker: recibe el índice de chunks del proceso
+# principal y sirve chunks en el puerto compartido. `peer_server` solo retorna si falla
+# (por ejemplo, al no poder abrir el puerto), así que el worker termina con error.
+# Los procesos de multiprocessing terminan sin ejecutar `atexit`, así que el worker vuelca su
+# registro de eventos al salir (también cuando el supervisor lo detiene con SIGTERM).
+def seeder_worker(chunk_index, cache_bytes):
+    global CHUNK_INDEX
+    CHUNK_INDEX = chunk_index
+    compression.COMPRESSED_CACHE_BYTES = cache_bytes
+    try:
+        peer_server(reuse_port=True)
+    finally:
+        TRACER.flush()
+    sys.exit(1)
+
+# Supervisor de los procesos worker: los lanza y relanza los que terminen inesperadamente.
+# Se ejecuta en el proceso principal del seeder, que no escucha en PEER_PORT.
+# Los reinicios de un worker se espacian con una espera que se duplica en cada fallo seguido;
+# tras WORKER_MAX_FAILURES fallos seguidos el worker se da por perdido, y si se pierden todos
+# el seeder termina con error para que lo reinicie su lanzador.
+def supervise_workers(num_workers, chunk_index):
+    cache_bytes = compression.COMPRESSED_CACHE_BYTES // num_workers
+
+    def spawn(worker_id):
+        process = multiprocessing.Process(target=seeder_worker, args=(chunk_index, cache_bytes),
+                                          name=f"seeder-worker-{worker_id}", daemon=True)
+        process.start()
+        print(f"Worker {worker_id} del seeder iniciado (PID {process.pid}).")
+        return {"process": process, "started": time.monotonic(), "failures": 0, "restart_at": None}
+
+    # Al recibir SIGTERM (por ejemplo, desde main.py) se sale por el bloque `finally`
+    # para detener también a los workers en lugar de dejarlos huérfanos con el puerto abierto.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    workers = [spawn(worker_id) for worker_id in range(num_workers)]
+    try:
+        while any(worker["process"] is not None or worker["restart_at"] is not None for worker in workers):
+            time.sleep(0.5)
+            now = time.monotonic()
+            for worker_id, worker in enumerate(workers):
+                process = worker["process"]
+                if process is not None and not process.is_alive():
+                    failures = 1 if now - worker["started"] >= WORKER_STABLE_TIME else worker["failures"] + 1
+                    worker.update(process=None, failures=failures)
+                    if failures >= WORKER_MAX_FAILURES:
+                        print(f"Worker {worker_id} del seeder falló {failures} veces seguidas "
+                              f"(código {process.exitcode}); no se volverá a lanzar.")
+                        continue
+                    delay = min(WORKER_RESTART_DELAY * 2 ** (failures - 1), WORKER_MAX_RESTART_DELAY)
+                    worker["restart_at"] = now + delay
+                    print(f"Worker {worker_id} del seeder terminó con código {process.exitcode}. "
+                          f"Reiniciándolo en {delay} s...")
+                elif worker["restart_at"] is not None and now >= worker["restart_at"]:
+                    failures = worker["failures"]
+                    worker.update(spawn(worker_id), failures=failures)
+        print("Todos los workers del seeder fallaron; el seeder se detiene.")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("Deteniendo workers del seeder...")
+    finally:
+        for worker in workers:
+            if worker["process"] is not None:
+                worker["process"].terminate()
+        for worker in workers:
+            if worker["process"] is not None:
+                worker["process"].join()
+
 # Función principal que inicia el proceso del Seeder.
-def start_seeder():
+def start_seeder(super_seeding=SUPER_SEEDING, workers=SEEDER_WORKERS):
     # 1. Divide el archivo de video/imagen en chunks y genera sus checksums.
+    notify_launcher(f"STATUS dividiendo {VIDEO_FILE} en chunks")
     parts = split_file(VIDEO_FILE)
     if not parts:
         print("No se pudieron generar chunks. Abortando seeder.")
         return
 
+    global CHUNK_INDEX
+    CHUNK_INDEX = build_chunk_index(parts)
+
     # 2. Registra el seeder en el tracker con la lista de chunks que ofrece.
-    # Usa la IP objetivo y el puerto del seeder.
+    # Usa la IP objetivo y el puerto del seeder. Se hace una sola vez, aunque haya varios workers.
     register_peer(TARGET_IP, PEER_PORT, parts) 
+    threading.Thread(target=announce_loop, args=(TARGET_IP, PEER_PORT, parts), daemon=True).start()
+
+    # En modo super-seeding, activa el reparto de un chunk por leecher y el monitor del tracker.
+    if super_seeding:
+        with SUPER_SEED_LOCK:
+            SUPER_SEED_STATE["active"] = True
+            SUPER_SEED_STATE["parts"] = list(parts)
+        threading.Thread(target=super_seed_monitor, args=(f"{TARGET_IP}:{PEER_PORT}",), daemon=True).start()
+        print("Super-seeding activado.")
 
     # 3. Inicia el servidor del seeder, que estará escuchando para servir los chunks.
+    # Con varios workers, el proceso principal solo supervisa y los workers comparten el puerto.
+    # El estado del super-seeding vive en memoria de un proceso, así que ese modo usa uno solo.
+    if workers > 1 and super_seeding:
+        print("El super-seeding requiere un único proceso; se ignora SEEDER_WORKERS.")
+    elif workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        print("SO_REUSEPORT no está disponible en este sistema; se usa un único proceso.")
+    elif workers > 1:
+        supervise_workers(workers, CHUNK_INDEX)
+        return
+
     # Este bucle `peer_server()` es bloqueante y se ejecuta indefinidamente.
     peer_server()
 
@@ -0,0 +1,329 @@
+import argparse
+import os
+import statistics
+import struct
+import sys
+
+# Herramienta offline para analizar los registros de eventos (flight recorder) que escriben el
+# tracker, el seeder y el leecher cuando se lanzan con la variable de entorno P2P_TRACE_DIR.
+# Une los archivos de todos los nodos en una única línea de tiempo y, para cada chunk descargado,
+# reparte su duración entre cola, conexión, espera al servidor, red, disco y hash. Después marca
+# los chunks que tardan mucho más que la mediana y calcula el camino crítico de cada leecher.
+#
+# Uso: python src/trace_timeline.py <directorio o archivos .trace> [--slow-factor 3]
+#
+# Los instantes de cada nodo se pasan a tiempo de pared con el reloj de referencia de su cabecera,
+# así que los nodos de máquinas distintas solo son comparables si sus relojes están sincronizados.
+
+TRACE_MAGIC = b"P2PTRACE"
+TRACE_HEADER = struct.Struct("<BQQH")    # versión, time_ns de referencia, monotonic_ns de referencia, longitud del nodo
+TRACE_RECORD = struct.Struct("<QBIIQ")   # instante monotónico (ns), evento, id de chunk, id de peer, valor
+TRACE_EVENTS = {1: "queue", 2: "connect", 3: "request", 4: "first_byte", 5: "last_byte",
+                6: "hash_start", 7: "hash_end", 8: "disk_write", 9: "announce", 10: "done"}
+
+# Categorías en las que se reparte el tiempo de cada chunk, en el orden en que se muestran.
+# - cola: esperando turno antes del primer intento (otros chunks, límites de concurrencia).
+# - reintentos: intentos fallidos o estancados antes del que terminó ganando.
+# - conexion: establecimiento de la conexión TCP con el peer.
+# - servidor: desde que el peer recibe la solicitud hasta que empieza a enviar (p. ej. compresión).
+# - espera: resto del tiempo hasta el primer byte (latencia de red, rechazos).
+# - red: transferencia desde el primer hasta el último byte, sin contar la escritura en disco.
+# - disco: escritura del chunk en disco.
+# - hash: verificación del SHA-256 del chunk.
+# - otros: reparación de bloques, renombrado del archivo y anuncios.
+CATEGORIES = ("cola", "reintentos", "conexion", "servidor", "espera", "red", "disco", "hash", "otros")
+
+# Lee un archivo de eventos y retorna (nodo, lista de eventos). Cada evento es una tupla
+# (instante de pared en ns, nombre del evento, chunk, peer, valor). Un archivo truncado (por
+# ejemplo, si el proceso murió antes de volcar su búfer) se lee hasta el último registro completo.
+def read_trace(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(f"{path} no es un archivo de eventos")
+    offset = len(TRACE_MAGIC)
+    version, wall_anchor, mono_anchor, node_len = TRACE_HEADER.unpack_from(data, offset)
+    if version != 1:
+        raise ValueError(f"{path}: versión de formato {version} no soportada")
+    offset += TRACE_HEADER.size
+    node = data[offset:offset + node_len].decode()
+    offset += node_len
+
+    strings = {}
+    events = []
+    while offset + TRACE_RECORD.size <= len(data):
+        ts, event, chunk_id, peer_id, value = TRACE_RECORD.unpack_from(data, offset)
+        offset += TRACE_RECORD.size
+        if event == 0:
+            # Definición de un texto: el id va en el campo de chunk y la longitud en el de peer.
+            if offset + peer_id > len(data):
+                break
+            strings[chunk_id] = data[offset:offset + peer_id].decode()
+            offset += peer_id
+            continue
+        events.append((wall_anchor + ts - mono_anchor, TRACE_EVENTS.get(event, f"evento_{event}"),
+                       strings.get(chunk_id, ""), strings.get(peer_id, ""), value))
+    return node, events
+
+# Componentes cuyos archivos de un mismo nodo se unen en una sola lista: los procesos worker
+# del seeder comparten puerto y atienden juntos. Los demás (en particular cada ejecución del
+# leecher, cuyo nodo es siempre el mismo) se muestran por separado, uno por archivo.
+MERGED_COMPONENTS = {"seeder"}
+
+# Función para obtener el nombre con el que se muestra un archivo de eventos: el nodo, seguido
+# del pid del proceso (tomado del nombre "<componente>-<pid>.trace") si no se une con los demás.
+def trace_label(file_path, node):
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    component, _, pid = name.rpartition("-")
+    if component in MERGED_COMPONENTS:
+        return node
+    return f"{node} (pid {pid})" if pid.isdigit() else f"{node} ({name})"
+
+# Función para obtener la dirección "IP:PUERTO" de un nombre mostrado ("leecher@IP:PUERTO (pid N)").
+def node_address(label):
+    return label.split("@", 1)[1].split(" ", 1)[0]
+
+# Reúne los archivos de eventos indicados (archivos sueltos o directorios con archivos `.trace`).
+# Retorna un diccionario {nombre: eventos ordenados por instante}, con un nombre por archivo
+# salvo los workers del seeder, que se unen bajo el nombre de su nodo (`trace_label`).
+def load_traces(paths):
+    nodes = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".trace")]
+        else:
+            files = [path]
+        for file_path in files:
+            try:
+                node, events = read_trace(file_path)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Se ignora {file_path}: {e}")
+                continue
+            nodes.setdefault(trace_label(file_path, node), []).extend(events)
+    for events in nodes.values():
+        events.sort(key=lambda event: event[0])
+    return nodes
+
+# Agrupa los eventos de un leecher en intentos de descarga: cada "connect" abre un intento nuevo
+# para ese (chunk, peer) y los eventos siguientes del mismo par se le asignan.
+# Retorna {chunk: {"queue": instante, "done": (instante, peer, éxito), "attempts": [...]}}.
+def build_pieces(events):
+    pieces = {}
+    open_attempts = {}
+    for ts, event, chunk, peer, value in events:
+        if not chunk or event == "announce":
+            continue
+        piece = pieces.setdefault(chunk, {"queue": None, "done": None, "attempts": []})
+        if event == "queue":
+            if piece["queue"] is None:
+                piece["queue"] = ts
+        elif event == "done":
+            piece["done"] = (ts, peer, bool(value))
+        elif event == "connect":
+            attempt = {"peer": peer, "start": ts - value, "connect": ts}
+            piece["attempts"].append(attempt)
+            open_attempts[(chunk, peer)] = attempt
+        elif (chunk, peer) in open_attempts:
+            attempt = open_attempts[(chunk, peer)]
+            if event == "disk_write":
+                attempt["disk_ns"] = value
+            elif event == "last_byte":
+                attempt["last_byte"] = ts
+                attempt["bytes"] = value
+            else:
+                attempt[event] = ts
+    return pieces
+
+# Busca en los nodos que sirven chunks (seeder o leechers) la solicitud que corresponde a un
+# intento: el nodo cuya dirección es el peer del intento, el mismo chunk y una solicitud recibida
+# entre el envío de la solicitud y la llegada del primer byte. Retorna el tiempo que el servidor
+# tardó en empezar a enviar (ns) o None si no hay registro del servidor.
+def server_delay(servers, attempt, chunk):
+    if "request" not in attempt or "first_byte" not in attempt:
+        return None
+    best = None
+    for ts, first_byte in servers.get((attempt["peer"], chunk), []):
+        if attempt["request"] - 5_000_000 <= ts <= attempt["first_byte"]:
+            if best is None or abs(ts - attempt["request"]) < abs(best[0] - attempt["request"]):
+                best = (ts, first_byte)
+    if best is None:
+        return None
+    return max(0, min(best[1], attempt["first_byte"]) - best[0])
+
+# Índice de las solicitudes atendidas por cada nodo: {(dirección, chunk): [(solicitud, primer byte)]}.
+# Las descargas propias de un leecher también registran "request", pero van precedidas de un
+# "connect" con el chunk, así que se descartan.
+def build_server_index(nodes):
+    servers = {}
+    for node, events in nodes.items():
+        if "@" not in node:
+            continue
+        address = node_address(node)
+        outgoing = {(chunk, peer) for _, event, chunk, peer, _ in events if event == "connect" and chunk}
+        pending = {}
+        for ts, event, chunk, peer, value in events:
+            if (chunk, peer) in outgoing:
+                continue
+            if event == "request":
+                pending[(chunk, peer)] = ts
+            elif event == "first_byte" and (chunk, peer) in pending:
+                servers.setdefault((address, chunk), []).append((pending.pop((chunk, peer)), ts))
+    return servers
+
+# Reparte el tiempo de un chunk completado entre las categorías. `queued` es el instante desde el
+# que se cuenta la cola (la entrada en la cola o, en el camino crítico, el fin del chunk anterior).
+# Retorna (duración por categoría en ns, intento ganador).
+def breakdown(piece, queued, servers, chunk):
+    done_ts, winner_peer, _ = piece["done"]
+    attempts = [a for a in piece["attempts"] if a["start"] <= done_ts]
+    winners = [a for a in attempts if a["peer"] == winner_peer and "hash_end" in a]
+    if not winners:
+        return None, None
+    winner = winners[-1]
+    first_start = min(a["start"] for a in attempts)
+    times = dict.fromkeys(CATEGORIES, 0)
+    times["cola"] = max(0, first_start - queued)
+    times["reintentos"] = winner["start"] - first_start
+    times["conexion"] = winner["connect"] - winner["start"]
+    request = winner.get("request", winner["connect"])
+    first_byte = winner.get("first_byte", request)
+    last_byte = winner.get("last_byte", first_byte)
+    times["otros"] = request - winner["connect"]
+    delay = server_delay(servers, winner, chunk)
+    times["servidor"] = min(delay or 0, max(0, first_byte - request))
+    times["espera"] = max(0, first_byte - request - times["servidor"])
+    times["disco"] = winner.get("disk_ns", 0)
+    times["red"] = max(0, last_byte - first_byte - times["disco"])
+    times["hash"] = winner["hash_end"] - winner.get("hash_start", winner["hash_end"])
+    times["otros"] += winner.get("hash_start", last_byte) - last_byte + done_ts - winner["hash_end"]
+    return times, winner
+
+def format_ms(ns):
+    return f"{ns / 1e6:9.1f}"
+
+def print_table(rows):
+    header = f"{'chunk':<12} {'peer':<21} {'total':>9} {'servicio':>9} " + \
+             " ".join(f"{name:>9}" for name in CATEGORIES) + f" {'MB/s':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        times = row["times"]
+        rate = row["bytes"] / max(row["transfer_ns"], 1) * 1e9 / (1024 * 1024)
+        flag = "  LENTO" if row["slow"] else ""
+        print(f"{row['chunk']:<12} {row['peer']:<21} {format_ms(row['total'])} {format_ms(row['service'])} " +
+              " ".join(format_ms(times[name]) for name in CATEGORIES) + f" {rate:7.1f}{flag}")
+
+# Analiza los chunks de un leecher: tabla por chunk, chunks lentos y camino crítico.
+def report_leecher(node, events, servers, slow_factor):
+    pieces = build_pieces(events)
+    rows = []
+    failed = []
+    for chunk, piece in pieces.items():
+        if piece["done"] is None or not piece["attempts"]:
+            continue
+        if not piece["done"][2]:
+            failed.append((chunk, len(piece["attempts"])))
+            continue
+        queued = piece["queue"] if piece["queue"] is not None else min(a["start"] for a in piece["attempts"])
+        times, winner = breakdown(piece, queued, servers, chunk)
+        if times is None:
+            continue
+        rows.append({"chunk": chunk, "peer": winner["peer"], "piece": piece, "queued": queued, "times": times,
+                     "total": piece["done"][0] - queued, "service": sum(times.values()) - times["cola"],
+                     "bytes": winner.get("bytes", 0),
+                     "transfer_ns": winner.get("last_byte", 0) - winner.get("first_byte", 0)})
+    if not rows and not failed:
+        return
+
+    print(f"\n=== {node}: {len(rows)} chunks completados, {len(failed)} fallidos (tiempos en ms) ===")
+    # Los chunks se comparan por su tiempo de servicio (sin la cola): en el leecher con hilos los
+    # chunks se descargan de uno en uno y la cola crece con la posición, no con la lentitud.
+    median = statistics.median(row["service"] for row in rows) if rows else 0
+    for row in rows:
+        row["slow"] = median > 0 and row["service"] > slow_factor * median
+    rows.sort(key=lambda row: row["piece"]["done"][0])
+    print_table(rows)
+    for chunk, attempts in failed:
+        print(f"{chunk:<12} sin completar tras {attempts} intentos")
+
+    slow = [row for row in rows if row["slow"]]
+    print(f"\nMediana del tiempo de servicio: {median / 1e6:.1f} ms; "
+          f"{len(slow)} chunks por encima de {slow_factor:g}x la mediana.")
+    for row in slow:
+        times = row["times"]
+        extra = {name: times[name] for name in CATEGORIES if name != "cola"}
+        cause = max(extra, key=extra.get)
+        print(f"  {row['chunk']} desde {row['peer']}: {row['service'] / 1e6:.1f} ms "
+              f"({row['service'] / median:.1f}x), sobre todo '{cause}' ({extra[cause] / 1e6:.1f} ms)")
+
+    # Camino crítico: desde el último chunk en terminar, se retrocede al chunk que terminó más
+    # tarde antes de que empezara el primer intento del actual (el que lo tenía esperando).
+    if not rows:
+        return # Todos los chunks fallaron: no hay camino crítico que mostrar.
+    path = []
+    current = max(rows, key=lambda row: row["piece"]["done"][0])
+    while current is not None:
+        path.append(current)
+        start = min(a["start"] for a in current["piece"]["attempts"])
+        previous = [row for row in rows if row is not current and row["piece"]["done"][0] <= start]
+        current = max(previous, key=lambda row: row["piece"]["done"][0]) if previous else None
+    path.reverse()
+
+    totals = dict.fromkeys(CATEGORIES, 0)
+    for index, row in enumerate(path):
+        # En el camino crítico la cola de cada chunk se cuenta desde el fin del anterior.
+        queued = path[index - 1]["piece"]["done"][0] if index else row["queued"]
+        times, _ = breakdown(row["piece"], queued, servers, row["chunk"])
+        for name in CATEGORIES:
+            totals[name] += times[name]
+    span = sum(totals.values())
+    print(f"\nCamino crítico ({len(path)} chunks, {span / 1e6:.1f} ms): " +
+          " -> ".join(row["chunk"] for row in path))
+    for name in sorted(CATEGORIES, key=totals.get, reverse=True):
+        if totals[name]:
+            print(f"  {name:<11} {format_ms(totals[name])} ms  {totals[name] / max(span, 1) * 100:5.1f}%")
+
+# Resumen de la actividad de los nodos que sirven chunks o coordinan (seeder, tracker).
+def report_server(node, events):
+    counts = {}
+    sent = 0
+    for _, event, _, _, value in events:
+        counts[event] = counts.get(event, 0) + 1
+        if event == "last_byte":
+            sent += value
+    hashing = []
+    starts = {}
+    for ts, event, chunk, _, _ in events:
+        if event == "hash_start":
+            starts[chunk] = ts
+        elif event == "hash_end" and chunk in starts:
+            hashing.append(ts - starts.pop(chunk))
+    summary = ", ".join(f"{event}={count}" for event, count in sorted(counts.items()))
+    print(f"\n=== {node} ===\n  eventos: {summary}")
+    if sent:
+        print(f"  enviados: {sent / (1024 * 1024):.1f} MB")
+    if hashing:
+        print(f"  hash de chunks al arrancar: {sum(hashing) / 1e6:.1f} ms en {len(hashing)} chunks")
+
+def main():
+    parser = argparse.ArgumentParser(description="Línea de tiempo de transferencias a partir de los registros de eventos.")
+    parser.add_argument("paths", nargs="+", help="directorios (P2P_TRACE_DIR) o archivos .trace")
+    parser.add_argument("--slow-factor", type=float, default=3.0,
+                        help="marca los chunks que tardan más de este múltiplo de la mediana (por defecto 3)")
+    args = parser.parse_args()
+
+    nodes = load_traces(args.paths)
+    if not nodes:
+        print("No se encontraron registros de eventos.")
+        return 1
+    servers = build_server_index(nodes)
+    for node in sorted(nodes):
+        events = nodes[node]
+        if any(event == "done" for _, event, _, _, _ in events):
+            report_leecher(node, events, servers, args.slow_factor)
+        else:
+            report_server(node, events)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
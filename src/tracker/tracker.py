@@ -3,6 +3,14 @@ import threading
 import time
 import os
 import ast
+import sys
+import json
+import shutil
+
+# Los módulos compartidos entre componentes están en `src/common`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.launcher import notify_launcher
+from common.tracing import create_recorder
 
 # Parámetros de configuración del Tracker
 TRACKER_PORT = 8000     # Puerto en el que el tracker escucha conexiones TCP de peers
@@ -12,22 +20,210 @@ DISCOVERY_PORT = 7000   # Puerto para el descubrimiento de peers (UDP Broadcast,
 # La clave es "IP:PUERTO" y el valor es una lista de los archivos (chunks) que ofrece ese peer.
 peers = {}
 
+# Instante (segundos desde epoch) del último registro de cada peer, para caducar los inactivos.
+peer_last_seen = {}
+# Protege `peers`, `peer_last_seen` y el log de escritura anticipada frente a los hilos de clientes.
+PEERS_LOCK = threading.Lock()
+
+# Persistencia del estado del tracker.
+# Cada registro o baja se añade a un log de escritura anticipada (WAL) en formato JSON por línea;
+# periódicamente el estado completo se vuelca a un snapshot y el WAL se vacía. Al arrancar se
+# carga el snapshot y se reproduce el WAL, de modo que un reinicio no deja vacío el enjambre.
+STATE_DIR = "tracker_state"
+SNAPSHOT_FILE = os.path.join(STATE_DIR, "snapshot.json")
+WAL_FILE = os.path.join(STATE_DIR, "tracker.wal")
+WAL_ROTATED_FILE = WAL_FILE + ".1"  # WAL anterior mientras se escribe un snapshot
+SNAPSHOT_INTERVAL = 60        # Segundos entre snapshots
+SNAPSHOT_MAX_WAL_ENTRIES = 50000  # Fuerza un snapshot antes si el WAL crece demasiado
+WAL_FSYNC = False             # True para sincronizar el WAL a disco en cada escritura (más lento)
+# Un peer que no se vuelve a registrar en PEER_TTL segundos se considera desaparecido.
+PEER_TTL = 30 * 60
+MAINTENANCE_INTERVAL = 5      # Segundos entre revisiones de caducidad y de snapshot
+
+# Estado del WAL abierto: archivo y número de entradas desde el último snapshot.
+WAL_STATE = {"file": None, "entries": 0}
+
+# Los clientes cierran su sentido de escritura tras enviar la solicitud, así que el tracker la lee
+# hasta el final (un REGISTER con cientos de chunks no cabe en un solo `recv`). Para clientes que
+# no lo hacen, REQUEST_IDLE_TIMEOUT segundos sin datos también dan la solicitud por terminada.
+REQUEST_IDLE_TIMEOUT = 1
+MAX_REQUEST_SIZE = 1024 * 1024  # Tamaño máximo de una solicitud (bytes)
+
 # Dirección IP donde el tracker escuchará. 
 # Vacío ("") significa que escucha en todas las interfaces de red disponibles.
 TRACKER_HOST = "" 
 
+# Añade una operación al WAL. `files` es la lista de chunks del peer, o None si el peer se da de baja.
+# Debe llamarse con PEERS_LOCK adquirido para que el orden del WAL coincida con el de memoria.
+def wal_append(peer_info, files, timestamp):
+    wal = WAL_STATE["file"]
+    if wal is None:
+        return
+    wal.write(json.dumps({"t": timestamp, "p": peer_info, "f": files}) + "\n")
+    wal.flush()
+    if WAL_FSYNC:
+        os.fsync(wal.fileno())
+    WAL_STATE["entries"] += 1
+
+# Aplica una operación (del cliente o del WAL) sobre el estado en memoria.
+def apply_update(peer_info, files, timestamp):
+    if files is None:
+        peers.pop(peer_info, None)
+        peer_last_seen.pop(peer_info, None)
+    else:
+        peers[peer_info] = files
+        peer_last_seen[peer_info] = timestamp
+
+# Registra o actualiza un peer en memoria y en el WAL.
+def register_peer(peer_info, file_list):
+    now = time.time()
+    with PEERS_LOCK:
+        apply_update(peer_info, file_list, now)
+        wal_append(peer_info, file_list, now)
+
+# Reproduce un archivo WAL sobre el estado en memoria. Una última línea incompleta
+# (por ejemplo, tras una caída a mitad de escritura) se ignora.
+def replay_wal(path):
+    replayed = 0
+    if not os.path.exists(path):
+        return replayed
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            apply_update(entry["p"], entry["f"], entry["t"])
+            replayed += 1
+    return replayed
+
+# Elimina los peers que no se han registrado en los últimos PEER_TTL segundos.
+# Debe llamarse con PEERS_LOCK adquirido.
+def expire_stale_peers():
+    cutoff = time.time() - PEER_TTL
+    stale = [peer_info for peer_info, seen in peer_last_seen.items() if seen < cutoff]
+    now = time.time()
+    for peer_info in stale:
+        apply_update(peer_info, None, now)
+        wal_append(peer_info, None, now)
+    return stale
+
+# Restaura el estado del tracker a partir del snapshot y los WAL, y abre el WAL para escritura.
+def restore_state():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    started = time.monotonic()
+    with PEERS_LOCK:
+        if os.path.exists(SNAPSHOT_FILE):
+            try:
+                with open(SNAPSHOT_FILE, 'r') as f:
+                    snapshot = json.load(f)
+                peers.update(snapshot["peers"])
+                peer_last_seen.update(snapshot["last_seen"])
+            except (ValueError, KeyError) as e:
+                print(f"Snapshot del tracker ilegible, se ignora: {e}")
+        # El WAL rotado existe si el tracker cayó mientras escribía un snapshot.
+        replayed = replay_wal(WAL_ROTATED_FILE) + replay_wal(WAL_FILE)
+        stale = expire_stale_peers()
+
+        # Compacta lo restaurado en un snapshot nuevo y empieza con el WAL vacío.
+        if replayed or stale:
+            dump_snapshot({"peers": peers, "last_seen": peer_last_seen})
+        if os.path.exists(WAL_ROTATED_FILE):
+            os.remove(WAL_ROTATED_FILE)
+        WAL_STATE["file"] = open(WAL_FILE, 'w')
+        WAL_STATE["entries"] = 0
+    print(f"Estado del tracker restaurado en {time.monotonic() - started:.3f} s: "
+          f"{len(peers)} peers ({replayed} entradas de WAL, {len(stale)} peers caducados).")
+
+# Escribe un snapshot del estado actual y vacía el WAL.
+# Con el lock solo se copia el estado y se rota el WAL; el volcado a disco se hace fuera
+# del lock para no bloquear a los clientes. Si el tracker cae antes de terminar, el WAL
+# rotado sigue en disco y se reproduce al arrancar.
+def write_snapshot():
+    with PEERS_LOCK:
+        state = {"peers": dict(peers), "last_seen": dict(peer_last_seen)}
+        WAL_STATE["file"].close()
+        if os.path.exists(WAL_ROTATED_FILE):
+            # Un snapshot anterior falló y su WAL rotado aún no está cubierto por ningún snapshot:
+            # el WAL actual se añade a continuación en lugar de sobrescribirlo. Si el tracker cae
+            # antes de borrar el WAL actual, sus entradas se reproducen dos veces, lo que no
+            # cambia el resultado porque se aplican en el mismo orden.
+            with open(WAL_FILE, 'rb') as src, open(WAL_ROTATED_FILE, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(WAL_FILE)
+        else:
+            os.replace(WAL_FILE, WAL_ROTATED_FILE)
+        WAL_STATE["file"] = open(WAL_FILE, 'a')
+        WAL_STATE["entries"] = 0
+
+    dump_snapshot(state)
+    os.remove(WAL_ROTATED_FILE)
+
+# Escribe el snapshot de forma atómica: primero a un archivo temporal y luego lo renombra.
+def dump_snapshot(state):
+    tmp_path = SNAPSHOT_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, SNAPSHOT_FILE)
+
+# Hilo de mantenimiento: caduca peers inactivos y escribe snapshots periódicos
+# (o antes de tiempo si el WAL supera SNAPSHOT_MAX_WAL_ENTRIES entradas).
+def maintenance_loop():
+    last_snapshot = time.monotonic()
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL)
+        try:
+            with PEERS_LOCK:
+                stale = expire_stale_peers()
+                entries = WAL_STATE["entries"]
+            if stale:
+                print(f"Peers caducados por inactividad: {stale}")
+            if entries and (entries >= SNAPSHOT_MAX_WAL_ENTRIES or
+                            time.monotonic() - last_snapshot >= SNAPSHOT_INTERVAL):
+                write_snapshot()
+                last_snapshot = time.monotonic()
+        except Exception as e:
+            print(f"Error en el mantenimiento del estado del tracker: {e}")
+
+# Registro de eventos para `src/trace_timeline.py` (ver `common/tracing.py`);
+# se activa con la variable de entorno P2P_TRACE_DIR.
+TRACER = create_recorder("tracker", f"tracker:{TRACKER_PORT}")
+trace_event = TRACER.event
+
+# Función para leer una solicitud completa de un cliente: hasta que cierra su sentido de
+# escritura, deja de enviar datos durante REQUEST_IDLE_TIMEOUT segundos o se alcanza MAX_REQUEST_SIZE.
+def read_request(conn):
+    conn.settimeout(REQUEST_IDLE_TIMEOUT)
+    data = b""
+    try:
+        while len(data) < MAX_REQUEST_SIZE:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    conn.settimeout(None)
+    return data[:MAX_REQUEST_SIZE].decode()
+
 # Función para manejar las conexiones individuales de los clientes (peers).
 # Se ejecuta en un hilo separado para no bloquear el servidor principal.
 def handle_client(conn, addr):
     try:
         # Recibe la solicitud del cliente. El cliente envía un comando como "REGISTER" o "DISCOVER".
-        data = conn.recv(1024).decode().strip()
+        data = read_request(conn).strip()
+        trace_event("request", data.split(" ", 1)[0], f"{addr[0]}:{addr[1]}")
         print(f"Solicitud recibida de {addr[0]}:{addr[1]}: '{data}'")
 
         if data == "DISCOVER":
             # Si la solicitud es "DISCOVER", el tracker devuelve una lista de los peers registrados.
             # Convertimos las claves del diccionario `peers` (que son "IP:PUERTO") a una lista.
-            available_peers = list(peers.keys())
+            with PEERS_LOCK:
+                available_peers = list(peers.keys())
             # Enviamos la lista convertida a string. Se necesita `ast.literal_eval` en el cliente para parsearla.
             conn.sendall(str(available_peers).encode())
             print(f"Enviando lista de peers a {addr[0]}:{addr[1]}: {available_peers}")
@@ -39,7 +235,8 @@ def handle_client(conn, addr):
             if len(parts) >= 2:
                 peer_info = parts[1] # "IP:PUERTO" del peer
                 file_list = parts[2:] # Lista de archivos/chunks que el peer ofrece
-                peers[peer_info] = file_list # Agrega/actualiza el peer en el diccionario
+                register_peer(peer_info, file_list) # Agrega/actualiza el peer en memoria y en el WAL
+                trace_event("announce", peer=peer_info, value=len(file_list))
                 print(f"Nuevo peer registrado: {peer_info} con archivos: {file_list}")
                 conn.sendall(b"Peer registrado correctamente.")
             else:
@@ -51,9 +248,11 @@ def handle_client(conn, addr):
             # Podría ser una mejora futura para devolver los chunks asociados a un peer.
             # Actualmente, la lógica del `leecher` y `seeder` asume que el `leecher` descarga de un `seeder` directamente.
             peer_to_query = data.split()[1]
-            if peer_to_query in peers:
+            with PEERS_LOCK:
+                peer_files = peers.get(peer_to_query)
+            if peer_files is not None:
                 # Si el peer existe, envía sus archivos (chunks) separados por comas.
-                conn.sendall(",".join(peers[peer_to_query]).encode())
+                conn.sendall(",".join(peer_files).encode())
             else:
                 conn.sendall(b"Peer no encontrado.")
 
@@ -78,11 +277,16 @@ def handle_client(conn, addr):
 def tracker_server():
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
+        # En sistemas POSIX, SO_REUSEADDR permite volver a abrir el puerto justo después de
+        # reiniciar el tracker, sin esperar a que caduquen las conexiones en TIME_WAIT.
+        if os.name == "posix":
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         # Vincula el socket a la dirección y puerto especificados.
         s.bind((TRACKER_HOST, TRACKER_PORT))
         # Empieza a escuchar conexiones. El número 10 es el tamaño de la cola de conexiones pendientes.
         s.listen(10)
         print(f"Tracker escuchando en {TRACKER_HOST}:{TRACKER_PORT}")
+        notify_launcher("READY")
         
         while True:
             # Acepta una nueva conexión entrante. `conn` es un nuevo objeto socket para la comunicación
@@ -104,12 +308,19 @@ def start_tracker():
     # después de iniciarlo (aunque en tu `main.py` solo se espera y luego se cierra).
     # Sin embargo, el servidor principal del tracker (dentro de `tracker_server`) tiene un bucle `while True`,
     # por lo que mantendrá el proceso del tracker vivo.
-    threading.Thread(target=tracker_server, daemon=True).start()
+    # Recupera el estado anterior (snapshot + WAL) antes de aceptar conexiones.
+    restore_state()
+    threading.Thread(target=maintenance_loop, daemon=True).start()
 
-    # Este bucle `while True` en el hilo principal del tracker mantiene el script en ejecución.
-    # Si se quitara, el script terminaría inmediatamente después de lanzar el hilo del servidor.
-    while True:
+    server_thread = threading.Thread(target=tracker_server, daemon=True)
+    server_thread.start()
+
+    # Este bucle en el hilo principal del tracker mantiene el script en ejecución mientras
+    # el servidor siga activo. Si el servidor falla (por ejemplo, el puerto está ocupado),
+    # el proceso termina con error en lugar de quedarse colgado sin escuchar.
+    while server_thread.is_alive():
         time.sleep(1) # Espera 1 segundo para no consumir CPU innecesariamente.
+    sys.exit(1)
 
 # Cuando el script se ejecuta directamente (no importado como módulo), inicia el tracker.
 if __name__ == "__main__":